@@ -0,0 +1,51 @@
+"""同時に計算する数に上限を設けた PBKDF2 ハッシャー。
+
+PBKDF2 は 1 回あたり数百ミリ秒 CPU を使うため、ログインや会員登録が集中すると
+同じワーカーの書籍ページの描画が待たされる。計算をセマフォで囲み、ハッシュ計算に使われる
+CPU をプロセスあたり PASSWORD_HASHING_WORKERS 本に抑える。上限を超えた分は空きを待つ。
+（hashlib の PBKDF2 は計算中に GIL を手放すので、計算中も他のスレッドの処理は止まらない）
+計算は呼び出し元のスレッドでそのまま行い、別スレッドへの受け渡しはしない。
+ASGI でイベントループを塞がないようにするのは認証ビュー側（accounts.views）の役目。
+"""
+
+import threading
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, must_update_salt
+
+_slots = None
+_slots_lock = threading.Lock()
+
+
+def get_hashing_slots():
+    """プロセスで 1 つだけ持つ、同時に計算できる数のセマフォを返す。"""
+
+    global _slots
+    if _slots is None:
+        with _slots_lock:
+            if _slots is None:
+                _slots = threading.BoundedSemaphore(settings.PASSWORD_HASHING_WORKERS)
+    return _slots
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 の同時計算数を制限するハッシャー。
+
+    algorithm は Django 標準と同じ `pbkdf2_sha256` なので既存のハッシュをそのまま検証できる。
+    反復回数は Django の既定値を下限とし、settings.PASSWORD_HASH_ITERATIONS で引き上げられる。
+    保存済みハッシュの回数がそれより少ない場合は、ログイン成功時に Django が自動で
+    再ハッシュして保存し直す（must_update）。多い場合は回数を下げる方向には作り直さない。
+    """
+
+    @property
+    def iterations(self):
+        return max(settings.PASSWORD_HASH_ITERATIONS or 0, PBKDF2PasswordHasher.iterations)
+
+    def encode(self, password, salt, iterations=None):
+        with get_hashing_slots():
+            return super().encode(password, salt, iterations)
+
+    def must_update(self, encoded):
+        decoded = self.decode(encoded)
+        update_salt = must_update_salt(decoded['salt'], self.salt_entropy)
+        return decoded['iterations'] < self.iterations or update_salt
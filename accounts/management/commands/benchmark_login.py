@@ -0,0 +1,100 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, get_hasher, make_password
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.management.base import BaseCommand
+
+
+# 反復回数の候補の既定値。PooledPBKDF2PasswordHasher は Django の既定値より少ない回数を使わないので、
+# 既定値から上だけを測る
+DEFAULT_CANDIDATES = [round(PBKDF2PasswordHasher.iterations * rate) for rate in (1, 1.25, 1.5, 2)]
+
+
+class Command(BaseCommand):
+    """パスワードハッシュの計測。反復回数の目安と、1 コアあたりのログイン処理数を表示する。"""
+
+    help = 'PBKDF2 の反復回数ごとの計算時間と、現在の設定でのログイン数/秒/コアを計測します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', type=int, nargs='+',
+            default=DEFAULT_CANDIDATES,
+            help=f'計測する反復回数の候補（{PBKDF2PasswordHasher.iterations:,} 回未満は測らない）',
+        )
+        parser.add_argument('--target-ms', type=float, default=250, help='1 回のハッシュに許容する時間（ミリ秒）')
+        parser.add_argument('--seconds', type=float, default=5, help='ログイン数の計測時間（秒）')
+        parser.add_argument('--threads', type=int, default=os.cpu_count() or 1, help='同時にログインするスレッド数')
+
+    def handle(self, *args, **options):
+        self.calibrate(options['iterations'], options['target_ms'])
+        self.measure_logins(options['seconds'], options['threads'])
+
+    def calibrate(self, candidates, target_ms):
+        minimum = PBKDF2PasswordHasher.iterations
+        skipped = [iterations for iterations in candidates if iterations < minimum]
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f'Django の既定値（{minimum:,} 回）未満は設定できないので測りません: '
+                + ', '.join(f'{iterations:,}' for iterations in skipped)
+            ))
+        candidates = [iterations for iterations in candidates if iterations >= minimum] or [minimum]
+        self.stdout.write('反復回数ごとの計算時間（1 スレッド）')
+        hasher = PBKDF2PasswordHasher()
+        salt = hasher.salt()
+        recommended = None
+        for iterations in sorted(candidates):
+            # 最初の 1 回は計測から外し、3 回の最小値を取る
+            hasher.encode('benchmark-password', salt, iterations)
+            elapsed = min(self._time(hasher.encode, 'benchmark-password', salt, iterations) for _ in range(3))
+            self.stdout.write(f'  {iterations:>9,} 回: {elapsed * 1000:7.1f} ms')
+            if elapsed * 1000 <= target_ms:
+                recommended = iterations
+        current = get_hasher().iterations
+        if recommended:
+            self.stdout.write(f'目安：{target_ms:.0f}ms 以内に収まる最大は {recommended:,} 回（現在の設定 {current:,} 回）')
+        else:
+            self.stdout.write(
+                f'目安：{target_ms:.0f}ms 以内に収まる候補がありません。既定値の {minimum:,} 回のままにしてください'
+                f'（現在の設定 {current:,} 回）'
+            )
+
+    def measure_logins(self, seconds, threads):
+        hasher = get_hasher()
+        encoded = make_password('benchmark-password')
+        deadline = time.perf_counter() + seconds
+
+        def worker():
+            count = 0
+            while time.perf_counter() < deadline:
+                check_password('benchmark-password', encoded)
+                count += 1
+            return count
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            total = sum(executor.map(lambda _: worker(), range(threads)))
+        elapsed = time.perf_counter() - started
+
+        # ハッシュ計算はこのプロセス内で PASSWORD_HASHING_WORKERS 本までしか並列にならないので、
+        # それを使用コア数とみなす（マシン全体ではこの本数 × ワーカー数になる）
+        cores = min(settings.PASSWORD_HASHING_WORKERS, threads, os.cpu_count() or 1)
+        rate = total / elapsed
+        self.stdout.write(
+            f'ログイン（{hasher.__class__.__name__}, {hasher.iterations:,} 回, '
+            f'{threads} スレッド, ハッシュ計算 {cores} コア）'
+        )
+        self.stdout.write(self.style.SUCCESS(f'  {rate:.1f} ログイン/秒, {rate / cores:.1f} ログイン/秒/コア'))
+        workers = int(os.environ.get('WEB_CONCURRENCY') or 1)
+        self.stdout.write(
+            f'  ワーカー {workers} プロセスでは最大 {cores * workers} コアでハッシュを計算します'
+            f'（CPU {os.cpu_count() or 1} コア）'
+        )
+
+    @staticmethod
+    def _time(func, *args):
+        started = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - started
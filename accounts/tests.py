@@ -1,3 +1,181 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import tempfile
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password, make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+
+from book.models import Book, Review
+
+from . import export
+from .hashers import PooledPBKDF2PasswordHasher
+
+# テストではハッシュ計算を軽くする（反復回数そのものを確かめるテストは除く）
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class AuthViewMethodTests(TestCase):
+    """非同期にした認証ビューが、フォーム以外のメソッドにも正しく応答すること。"""
+
+    urls = ('/accounts/login/', '/accounts/signup/')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_options(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.options(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('POST', response['Allow'])
+
+    def test_method_not_allowed(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                with self.assertLogs('django.request', 'WARNING'):
+                    response = self.client.delete(url)
+                self.assertEqual(response.status_code, 405)
+                self.assertIn('GET', response['Allow'])
+
+    def test_login_page_is_not_cached(self):
+        self.assertIn('no-cache', self.client.options('/accounts/login/')['Cache-Control'])
+
+    async def test_async_client(self):
+        client = AsyncClient()
+        self.assertEqual((await client.options('/accounts/login/')).status_code, 200)
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual((await client.patch('/accounts/signup/')).status_code, 405)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class AuthThrottleTests(TestCase):
+    """ログインの試行回数が上限を超えたら 429 を返すこと。"""
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user('reader', password='correct-password')
+
+    @override_settings(AUTH_THROTTLE_RATES={'login-ip': (100, 60), 'login-user': (2, 60)})
+    def test_login_user_limit(self):
+        for _ in range(2):
+            response = self.client.post('/accounts/login/', {'username': 'reader', 'password': 'wrong'})
+            self.assertEqual(response.status_code, 200)
+        response = self.client.post('/accounts/login/', {'username': 'READER', 'password': 'correct-password'})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        # 別のアカウントは制限されない
+        response = self.client.post('/accounts/login/', {'username': 'someone', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 200)
+
+
+class PasswordHasherTests(SimpleTestCase):
+    """反復回数は Django の既定値を下回らず、保存済みのハッシュを弱める方向に作り直さないこと。"""
+
+    def setUp(self):
+        self.hasher = PooledPBKDF2PasswordHasher()
+        self.default = PBKDF2PasswordHasher.iterations
+
+    def encoded(self, iterations):
+        return self.hasher.encode('password', self.hasher.salt(), iterations)
+
+    def test_iterations_never_below_django_default(self):
+        for configured, expected in ((None, self.default), (1000, self.default), (self.default + 1, self.default + 1)):
+            with self.subTest(configured=configured), override_settings(PASSWORD_HASH_ITERATIONS=configured):
+                self.assertEqual(self.hasher.iterations, expected)
+
+    def test_must_update_only_raises_iterations(self):
+        self.assertTrue(self.hasher.must_update(self.encoded(self.default - 1)))
+        self.assertFalse(self.hasher.must_update(self.encoded(self.default)))
+        self.assertFalse(self.hasher.must_update(self.encoded(self.default + 1)))
+
+    def test_stronger_hash_is_kept_on_login(self):
+        encoded = self.encoded(self.default + 1)
+        setter_calls = []
+        self.assertTrue(check_password('password', encoded, setter=setter_calls.append))
+        self.assertEqual(setter_calls, [])
+
+    def test_compatible_with_django_hasher(self):
+        encoded = make_password('password', hasher=PBKDF2PasswordHasher())
+        self.assertTrue(self.hasher.verify('password', encoded))
+
+
+class ExportTests(TestCase):
+    """エクスポートの zip に自分の書籍・レビューと表紙画像だけが入ること。"""
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.user = User.objects.create_user('reader')
+        other = User.objects.create_user('other')
+        self.image = bytes(range(256)) * 10
+        default_storage.save('cover.jpg', ContentFile(self.image))
+        self.book = Book.objects.create(
+            title='エクスポート, "引用符"', text='1行目\n2行目', category='other', thumbnail='cover.jpg', user=self.user
+        )
+        # DB にだけ残っている画像は zip に入れない
+        Book.objects.create(title='画像なし', text='本文', category='other', thumbnail='missing.jpg', user=self.user)
+        other_book = Book.objects.create(title='他人の書籍', text='本文', category='other', user=other)
+        self.review = Review.objects.create(book=other_book, title='感想', text='本文', rate=4, user=self.user)
+        Review.objects.create(book=self.book, title='他人の感想', text='本文', rate=1, user=other)
+        self.client.force_login(self.user)
+
+    def download(self, query=''):
+        response = self.client.get(f'/accounts/export/{query}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('bookfolio-reader-', response['Content-Disposition'])
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_jsonl(self):
+        archive = self.download()
+        self.assertEqual(archive.namelist(), ['books.jsonl', 'reviews.jsonl', 'thumbnails/cover.jpg'])
+        books = [json.loads(line) for line in archive.read('books.jsonl').decode().splitlines()]
+        self.assertEqual([book['title'] for book in books], ['エクスポート, "引用符"', '画像なし'])
+        self.assertEqual(books[0]['text'], '1行目\n2行目')
+        self.assertEqual(books[0]['thumbnail'], 'thumbnails/cover.jpg')
+        reviews = [json.loads(line) for line in archive.read('reviews.jsonl').decode().splitlines()]
+        self.assertEqual(
+            [(review['id'], review['book_title'], review['rate']) for review in reviews],
+            [(self.review.pk, '他人の書籍', 4)],
+        )
+        self.assertEqual(archive.read('thumbnails/cover.jpg'), self.image)
+
+    def test_csv(self):
+        archive = self.download('?format=csv')
+        self.assertEqual(archive.namelist(), ['books.csv', 'reviews.csv', 'thumbnails/cover.jpg'])
+        content = archive.read('books.csv')
+        self.assertTrue(content.startswith('\ufeff'.encode()))
+        books = list(csv.DictReader(io.StringIO(content.decode('utf-8-sig'))))
+        self.assertEqual(list(books[0]), export.BOOK_FIELDS)
+        self.assertEqual((books[0]['title'], books[0]['text']), ('エクスポート, "引用符"', '1行目\n2行目'))
+        reviews = list(csv.DictReader(io.StringIO(archive.read('reviews.csv').decode('utf-8-sig'))))
+        self.assertEqual([review['title'] for review in reviews], ['感想'])
+
+    def test_streamed_in_chunks(self):
+        with mock.patch.object(export, 'FLUSH_SIZE', 256):
+            chunks = list(export.iter_export_zip(self.user))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(zipfile.ZipFile(io.BytesIO(b''.join(chunks))).read('thumbnails/cover.jpg'), self.image)
+
+    async def test_streamed_in_chunks_under_asgi(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        with mock.patch.object(export, 'FLUSH_SIZE', 256):
+            response = await client.get('/accounts/export/')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async)
+            chunks = [chunk async for chunk in response]
+        self.assertGreater(len(chunks), 1)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+        self.assertEqual(archive.namelist(), ['books.jsonl', 'reviews.jsonl', 'thumbnails/cover.jpg'])
+        self.assertEqual(archive.read('thumbnails/cover.jpg'), self.image)
@@ -0,0 +1,56 @@
+"""認証まわりの回数制限。IP アドレスやユーザーごとに一定時間内の試行回数を数える。
+
+回数は既定のキャッシュで数える。ワーカー間で共有されるキャッシュ（settings.CACHE_BACKEND）が
+無い場合はワーカーごとに数えるので、実際の上限は設定の回数 × ワーカー数になる。
+DB キャッシュの incr は読み出しと書き込みが別なので、同時の試行はわずかに少なく数えることがある。
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def client_ip(request):
+    """リクエスト元の IP アドレス。プロキシ配下では X-Forwarded-For の先頭を使う。"""
+
+    if settings.THROTTLE_TRUST_X_FORWARDED_FOR:
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+class Throttle:
+    """固定ウィンドウ方式のカウンター。`scope` ごとの上限は settings.AUTH_THROTTLE_RATES で決める。"""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.limit, self.window = settings.AUTH_THROTTLE_RATES[scope]
+
+    def hit(self, ident):
+        """1 回分を数える。上限を超えていれば再試行まで待つ秒数、超えていなければ None を返す。"""
+
+        now = time.time()
+        window_start = int(now // self.window)
+        digest = hashlib.sha256(str(ident).encode()).hexdigest()[:32]
+        key = f'throttle:{self.scope}:{digest}:{window_start}'
+        cache.add(key, 0, self.window)
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # add と incr の間に期限切れになった場合
+            cache.set(key, 1, self.window)
+            count = 1
+        if count > self.limit:
+            return max(int((window_start + 1) * self.window - now), 1)
+        return None
+
+
+def check_throttles(pairs):
+    """(scope, 識別子) の組をすべて数え、最も長い待ち秒数を返す。制限にかからなければ None。"""
+
+    waits = [Throttle(scope).hit(ident) for scope, ident in pairs if ident]
+    waits = [wait for wait in waits if wait]
+    return max(waits) if waits else None
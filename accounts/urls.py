@@ -1,7 +1,7 @@
 from django.urls import path
 from django.contrib.auth.views import LogoutView
 
-from .views import SignupView, ProfileUpdateView, LoginView
+from .views import SignupView, ProfileUpdateView, LoginView, ExportView
 
 # 認証まわりの URL をまとめる。`app_name` で名前空間を付けて衝突を防ぐ
 app_name = 'accounts'
@@ -15,4 +15,6 @@ urlpatterns = [
     path('signup/', SignupView.as_view(), name='signup'),
     # プロフィール（ユーザー名＋パスワード変更）ページ
     path('profile/', ProfileUpdateView.as_view(), name='profile-edit'),
+    # 自分の書籍・レビュー・表紙画像を zip でダウンロード
+    path('export/', ExportView.as_view(), name='export'),
 ]
@@ -1,14 +1,71 @@
+import logging
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
 from django.contrib.auth.views import LoginView as AuthLoginView
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.shortcuts import render
 from django.urls import reverse_lazy
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+from django.views import View
 from django.views.generic import CreateView, UpdateView
 
+from book.streaming import streaming_response
+
 from .forms import SignupForm, UserCredentialUpdateForm, LoginForm
+from .throttling import check_throttles, client_ip
+
+logger = logging.getLogger('django.request')
+
+
+class OffloadedAuthViewMixin:
+    """パスワードハッシュを伴う認証ビューを非同期ビューとして動かす Mixin。
+
+    ASGI ではイベントループを塞がないよう、従来の同期処理（フォーム検証・DB 保存）を
+    まとめてスレッドで実行する。ハッシュ計算の同時実行数は accounts.hashers で制限される。
+    POST（ProcessFormView では PUT も同じ処理）はハッシュ計算の前に回数制限をかけ、
+    超えた場合は 429 を返す。
+    """
+
+    view_is_async = True
+
+    def get_throttle_keys(self, request):
+        """(scope, 識別子) のリスト。scope は settings.AUTH_THROTTLE_RATES のキー。"""
+
+        return []
+
+    async def dispatch(self, request, *args, **kwargs):
+        return await sync_to_async(self._dispatch_sync)(request, *args, **kwargs)
+
+    def _dispatch_sync(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            retry_after = check_throttles(self.get_throttle_keys(request))
+            if retry_after:
+                response = render(request, 'accounts/throttled.html', {'retry_after': retry_after}, status=429)
+                response['Retry-After'] = str(retry_after)
+                return response
+        return super().dispatch(request, *args, **kwargs)
+
+    # dispatch の中身はスレッドで同期的に動き、never_cache などのデコレーターも応答オブジェクトを
+    # 受け取る前提なので、View の既定（view_is_async ならコルーチンを返す）を同期版で置き換える
+    def options(self, request, *args, **kwargs):
+        response = HttpResponse()
+        response.headers['Allow'] = ', '.join(self._allowed_methods())
+        response.headers['Content-Length'] = '0'
+        return response
+
+    def http_method_not_allowed(self, request, *args, **kwargs):
+        logger.warning(
+            'Method Not Allowed (%s): %s', request.method, request.path,
+            extra={'status_code': 405, 'request': request},
+        )
+        return HttpResponseNotAllowed(self._allowed_methods())
 
 
-class SignupView(CreateView):
+class SignupView(OffloadedAuthViewMixin, CreateView):
     """新規ユーザー登録ビュー。"""
 
     model = User
@@ -16,15 +73,25 @@ class SignupView(CreateView):
     template_name = 'accounts/signup.html'
     success_url = reverse_lazy('book:index')
 
+    def get_throttle_keys(self, request):
+        return [('signup-ip', client_ip(request))]
+
 
-class LoginView(AuthLoginView):
+class LoginView(OffloadedAuthViewMixin, AuthLoginView):
     """ログインビュー。カスタムフォームを差し込む。"""
 
     authentication_form = LoginForm
     template_name = 'registration/login.html'
 
+    def get_throttle_keys(self, request):
+        # IP ごとの総当たりと、1 つのアカウントへの集中の両方を抑える
+        return [
+            ('login-ip', client_ip(request)),
+            ('login-user', request.POST.get('username', '').strip().lower()),
+        ]
 
-class ProfileUpdateView(LoginRequiredMixin, UpdateView):
+
+class ProfileUpdateView(OffloadedAuthViewMixin, LoginRequiredMixin, UpdateView):
     """会員情報編集ビュー。ログインユーザー自身のみ編集可能。"""
 
     model = User
@@ -32,6 +99,11 @@ class ProfileUpdateView(LoginRequiredMixin, UpdateView):
     template_name = 'accounts/profile_edit.html'
     success_url = reverse_lazy('accounts:profile-edit')
 
+    def get_throttle_keys(self, request):
+        if not request.user.is_authenticated:
+            return []
+        return [('profile-user', request.user.pk)]
+
     def get_object(self):
         # 常にログインユーザー本人のみを編集対象にする
         return self.request.user
@@ -47,3 +119,32 @@ class ProfileUpdateView(LoginRequiredMixin, UpdateView):
         response = super().form_valid(form)
         update_session_auth_hash(self.request, self.object)
         return response
+
+
+class ExportView(LoginRequiredMixin, View):
+    """ログインユーザー自身の書籍・レビュー・表紙画像を zip でダウンロードさせる。
+
+    zip は生成した分から順に送るので、件数が多くてもメモリに全体を持たない。
+    `?format=csv` で CSV、それ以外は JSON Lines で書き出す。
+    """
+
+    def get(self, request):
+        retry_after = check_throttles([('export-user', request.user.pk)])
+        if retry_after:
+            response = render(request, 'accounts/throttled.html', {'retry_after': retry_after}, status=429)
+            response['Retry-After'] = str(retry_after)
+            return response
+
+        # zip の生成処理はダウンロード時にだけ読み込む（起動時間のため）
+        from .export import FORMATS, iter_export_zip
+
+        export_format = request.GET.get('format', 'jsonl')
+        if export_format not in FORMATS:
+            export_format = 'jsonl'
+        filename = f'bookfolio-{request.user.username}-{timezone.localdate():%Y%m%d}.zip'
+        # ASGI でも zip 全体を作ってから送らないよう、streaming_response で 1 チャンクずつ送る
+        response = streaming_response(
+            request, iter_export_zip(request.user, export_format), content_type='application/zip'
+        )
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+        return response
@@ -1,5 +1,97 @@
-from django.contrib import admin
-from .models import Book, Review
+from django.contrib import admin, messages
+from django.db import connections, router, transaction
+from django.utils import timezone
 
-admin.site.register(Book)
-admin.site.register(Review)
\ No newline at end of file
+from . import autocomplete
+from .caching import bump_content_version
+from .consts import ADMIN_DELETE_BATCH_SIZE
+from .histograms import rebuild_histograms
+from .models import Book, ContentChange, Review, TimelineEntry, CATEGORY
+from .paginators import EstimatedCountPaginator
+
+
+def _set_category_action(value, label):
+    """選択した書籍のカテゴリを 1 回の UPDATE で変更するアクションを作る。"""
+
+    def action(modeladmin, request, queryset):
+        updated = queryset.update(category=value, updated_at=timezone.now())
+        bump_content_version()
+        modeladmin.message_user(request, f'{updated}件の書籍のカテゴリを「{label}」に変更しました。')
+
+    action.__name__ = f'set_category_{value}'
+    action.short_description = f'カテゴリを「{label}」に変更'
+    return action
+
+
+@admin.register(Book)
+class BookAdmin(admin.ModelAdmin):
+    """書籍の管理画面。件数が多くても一覧が重くならないよう調整している。"""
+
+    list_display = ('id', 'title', 'category', 'user', 'created_at')
+    list_display_links = ('id', 'title')
+    list_select_related = ('user',)
+    list_filter = ('category',)
+    search_fields = ('title',)
+    autocomplete_fields = ('user',)
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    # 「全 N 件」表示のための 2 回目の COUNT(*) を発行しない
+    show_full_result_count = False
+    actions = [_set_category_action(value, label) for value, label in CATEGORY]
+
+
+@admin.register(Review)
+class ReviewAdmin(admin.ModelAdmin):
+    """レビューの管理画面。書籍・ユーザーは JOIN して 1 回のクエリで一覧を取る。"""
+
+    list_display = ('id', 'title', 'book', 'user', 'rate', 'created_at')
+    list_display_links = ('id', 'title')
+    list_select_related = ('book', 'user')
+    list_filter = ('rate',)
+    search_fields = ('title',)
+    autocomplete_fields = ('book', 'user')
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['delete_reviews']
+
+    def get_actions(self, request):
+        # 標準の削除は確認画面で関連するオブジェクトを全件読み込んで表示するので、確認画面の無い削除に置き換える
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    @admin.action(description='選択したレビューを削除（一括）', permissions=['delete'])
+    def delete_reviews(self, request, queryset):
+        # 1 件ずつのシグナルを通さず、ID 順に一定件数ずつ 1 回の DELETE で消す。
+        # レビューから作る派生データは、バッチごとに対象の書籍の分だけまとめて作り直す
+        deleted = 0
+        while True:
+            rows = list(queryset.order_by('pk').values_list('pk', 'book_id')[:ADMIN_DELETE_BATCH_SIZE])
+            if not rows:
+                break
+            review_ids = [review_id for review_id, _ in rows]
+            book_ids = {book_id for _, book_id in rows}
+            with transaction.atomic():
+                # TimelineEntry には削除のシグナルが無いので、これも 1 回の DELETE になる
+                TimelineEntry.objects.filter(review_id__in=review_ids).delete()
+                deleted += _delete_rows(Review, review_ids)
+                rebuild_histograms(book_ids)
+                Book.objects.filter(pk__in=book_ids).update(updated_at=timezone.now())
+                ContentChange.mark()
+            autocomplete.books_refreshed(book_ids)
+            bump_content_version()
+        self.message_user(request, f'{deleted}件のレビューを削除しました。', messages.SUCCESS)
+
+
+def _delete_rows(model, pks):
+    """シグナルもカスケードも通さずに `pks` の行を 1 回の DELETE で消し、消した件数を返す。"""
+
+    connection = connections[router.db_for_write(model)]
+    qn = connection.ops.quote_name
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {qn(model._meta.db_table)} WHERE {qn(model._meta.pk.column)} IN ({placeholders})', pks
+        )
+        return cursor.rowcount
@@ -0,0 +1,152 @@
+"""過負荷時の流入制御（アドミッションコントロール）。
+
+ルートを URL 名で重さの段階（tier）に分け、段階ごとにプロセス内で同時に処理する
+リクエスト数の上限を設ける。上限に達したら短い待ち行列で最大 `timeout` 秒だけ待たせ、
+それでも空かなければ 503 と Retry-After を返す。検索や一覧の描画が詰まっても
+詳細ページなど軽いルートの処理枠は別なので、そちらは応答し続けられる。
+
+段階ごとの上限は settings.ADMISSION_TIERS で決める。
+"""
+
+import threading
+import time
+
+from django.conf import settings
+
+# URL 名 → 段階。ここに無いルートは DEFAULT_TIER（検索語付きなら SEARCH_TIER）、admin は制御しない
+ROUTE_TIERS = {
+    'book:index': 'standard',
+    'book:list-book': 'expensive',
+    'book:detail-book': 'cheap',
+    'book:autocomplete': 'cheap',
+    'book:create-book': 'expensive',
+    'book:update-book': 'expensive',
+    'book:review': 'standard',
+    'book:sitemap': 'cheap',
+    'book:sitemap-books': 'standard',
+    'book:feed': 'cheap',
+    'book:admission-stats': 'cheap',
+    'accounts:export': 'expensive',
+}
+# q= を受け取って全文の部分一致で検索するルートの、検索時の段階
+ROUTE_SEARCH_TIERS = {
+    'book:index': 'expensive',
+}
+DEFAULT_TIER = 'standard'
+# どちらの表にも無いルートへのキーワード検索（q=）は重い段階として扱う。
+# 入力補完のように q を受け取っても軽いルートは ROUTE_TIERS の段階をそのまま使う
+SEARCH_TIER = 'expensive'
+UNCONTROLLED_NAMESPACES = ('admin',)
+
+
+class Tier:
+    """1 つの段階の処理枠。同時実行数の上限と、待ち行列の長さ・待ち時間の上限を持つ。"""
+
+    def __init__(self, name, concurrency, queue, timeout, retry_after):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._condition = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def acquire(self):
+        """処理枠を 1 つ確保する。確保できなければ False。"""
+
+        with self._condition:
+            if self.in_flight < self.concurrency and not self.waiting:
+                self.in_flight += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.queue:
+                self.rejected += 1
+                return False
+
+            self.waiting += 1
+            self.queued += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            deadline = time.monotonic() + self.timeout
+            try:
+                while self.in_flight >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        self.timed_out += 1
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'concurrency': self.concurrency,
+                'queue': self.queue,
+                'timeout': self.timeout,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'max_waiting': self.max_waiting,
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+            }
+
+
+_tiers = None
+_tiers_lock = threading.Lock()
+
+
+def get_tiers():
+    """settings.ADMISSION_TIERS から作った段階の一覧（ワーカーごとに 1 つ）。"""
+
+    global _tiers
+    if _tiers is None:
+        with _tiers_lock:
+            if _tiers is None:
+                _tiers = {name: Tier(name, **options) for name, options in settings.ADMISSION_TIERS.items()}
+    return _tiers
+
+
+def reset_tiers():
+    """段階を作り直す。設定を変えて負荷試験をやり直すときに使う。"""
+
+    global _tiers
+    with _tiers_lock:
+        _tiers = None
+
+
+def classify(request):
+    """リクエストの段階名を返す。制御しないルートなら None。"""
+
+    match = request.resolver_match
+    if match is None or any(namespace in UNCONTROLLED_NAMESPACES for namespace in match.namespaces):
+        return None
+    searching = bool(request.GET.get('q', '').strip())
+    if searching and match.view_name in ROUTE_SEARCH_TIERS:
+        return ROUTE_SEARCH_TIERS[match.view_name]
+    tier = ROUTE_TIERS.get(match.view_name)
+    if tier is not None:
+        return tier
+    return SEARCH_TIER if searching else DEFAULT_TIER
+
+
+def stats():
+    """段階ごとの処理中・待ち行列・拒否の件数。"""
+
+    return {name: tier.stats() for name, tier in get_tiers().items()}
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class BookConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'book'
+
+    def ready(self):
+        # 保存・削除に連動して入力補完インデックスなどを更新するシグナルを登録
+        from . import signals  # noqa: F401
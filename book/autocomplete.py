@@ -0,0 +1,403 @@
+"""書籍タイトルの入力補完用インデックス。
+
+タイトルを正規化し、1 文字・2 文字の断片（n-gram）ごとに、その断片を含む書籍の番号の
+一覧（転置リスト）を作る。書籍には先にレビュー件数の多い順で番号を振るので、転置リストは
+最初からランキング順に並ぶ。検索では入力に含まれる断片のうち最も短いリストを先頭から読み、
+タイトル全体と照合しながら、上位 N 件が確定した時点で打ち切る。
+
+転置リストは断片のコード順に並べた `array` 3 本（断片・開始位置・書籍番号）にまとめて持ち、
+dict の入れ子や接尾辞ごとの文字列は作らない。1 冊あたりのメモリは「タイトル長 × 十数バイト」程度。
+
+インデックスの作成はリクエストの処理中には行わず、バックグラウンドのスレッドで作って差し替える
+（作成が終わるまでの間だけ DB を検索する）。保存・削除・レビュー件数の変化はシグナル経由で
+小さな差分領域に積み、AUTOCOMPLETE_REBUILD_INTERVAL 秒ごと、または差分が DELTA_LIMIT を
+超えたときに作り直す。作成中に変わった書籍は、作成後に DB から読み直して反映する。
+"""
+
+import logging
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+from django.db import connections
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+
+from .consts import AUTOCOMPLETE_REBUILD_INTERVAL, AUTOCOMPLETE_RESULTS
+from .models import Book
+
+logger = logging.getLogger(__name__)
+
+# 差分領域の件数がこれを超えたら作り直す
+DELTA_LIMIT = 500
+# タイトル同士の境界に置く区切り文字。正規化後のタイトルには現れない
+SEPARATOR = '\x00'
+
+# カタカナ（ァ〜ヶ）をひらがなに寄せる変換表。「ぱいそん」でも「パイソン」がヒットする
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord('ァ'), ord('ヶ') + 1)}
+_SPACES = re.compile(r'\s+')
+# 2 文字の断片のコードは「1 文字目 << 21 | 2 文字目」。1 文字のコード（0x10FFFF 以下）とは重ならない
+_CODE_BITS = 21
+
+
+def normalize(text):
+    """全角/半角・大文字/小文字・カタカナ/ひらがなの揺れを吸収した検索用文字列を返す。"""
+
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    text = text.translate(_KATAKANA_TO_HIRAGANA)
+    return _SPACES.sub('', text).replace(SEPARATOR, '')
+
+
+def gram_codes(normalized):
+    """正規化済みの文字列に含まれる 1 文字・2 文字の断片のコード（重複なし）。"""
+
+    codes = {ord(char) for char in normalized}
+    codes.update((ord(a) << _CODE_BITS) | ord(b) for a, b in zip(normalized, normalized[1:]))
+    return codes
+
+
+def _query_codes(needle):
+    """検索語を含むタイトルが必ず持つ断片のコード。1 文字ならその文字、2 文字以上なら 2 文字の断片。"""
+
+    if len(needle) == 1:
+        return {ord(needle)}
+    return {(ord(a) << _CODE_BITS) | ord(b) for a, b in zip(needle, needle[1:])}
+
+
+class TitleIndex:
+    """タイトルの転置インデックスと、作成後の保存・削除の差分を保持する。"""
+
+    def __init__(self, rows=()):
+        """`rows` は (書籍ID, タイトル, レビュー件数) の並び。順序は問わない。"""
+
+        self._lock = threading.Lock()
+        # 書籍番号（レビュー件数の多い順）ごとの ID・件数・表示用タイトル・正規化タイトルの開始位置
+        self._ids = array('q')
+        self._counts = array('l')
+        self._titles = []
+        self._starts = array('l')
+        parts = []
+        offset = 0
+        postings = {}
+        for rank, (book_id, title, review_count) in enumerate(
+            sorted(rows, key=lambda row: (row[2], row[0]), reverse=True)
+        ):
+            normalized = normalize(title)
+            self._ids.append(book_id)
+            self._counts.append(review_count)
+            self._titles.append(title)
+            self._starts.append(offset)
+            parts.append(normalized)
+            offset += len(normalized) + 1
+            for code in gram_codes(normalized):
+                bucket = postings.get(code)
+                if bucket is None:
+                    postings[code] = bucket = array('l')
+                bucket.append(rank)
+        # 末尾の番兵。番号 r のタイトルは _text[_starts[r]:_starts[r + 1] - 1]
+        self._starts.append(offset)
+        self._text = SEPARATOR.join(parts) + SEPARATOR
+
+        # 断片ごとの配列を、コード順の 1 本の配列にまとめ直す
+        self._codes = array('q', sorted(postings))
+        self._offsets = array('l', [0])
+        self._postings = array('l')
+        for code in self._codes:
+            self._postings.extend(postings.pop(code))
+            self._offsets.append(len(self._postings))
+
+        # ID → 書籍番号の引き当て用（ID 昇順）
+        order = sorted(range(len(self._ids)), key=self._ids.__getitem__)
+        self._sorted_ids = array('q', (self._ids[rank] for rank in order))
+        self._sorted_ranks = array('l', order)
+
+        # 作成後に変わった書籍。変更・削除分は tombstone、追加・変更分は delta に入れる
+        self._tombstones = set()
+        self._delta = {}
+        self.built_at = time.monotonic()
+
+    @classmethod
+    def from_database(cls, book_ids=None):
+        return cls(_database_rows(book_ids))
+
+    def __len__(self):
+        return len(self._ids) - len(self._tombstones) + len(self._delta)
+
+    @property
+    def needs_rebuild(self):
+        return len(self._delta) + len(self._tombstones) > DELTA_LIMIT
+
+    @property
+    def is_stale(self):
+        return self.needs_rebuild or time.monotonic() - self.built_at > AUTOCOMPLETE_REBUILD_INTERVAL
+
+    def _rank(self, book_id):
+        """書籍番号を返す。作成時に含まれていない書籍なら None。"""
+
+        index = bisect_left(self._sorted_ids, book_id)
+        if index < len(self._sorted_ids) and self._sorted_ids[index] == book_id:
+            return self._sorted_ranks[index]
+        return None
+
+    def _candidates(self, needle):
+        """`needle` を含みうる書籍番号（レビュー件数の多い順）。"""
+
+        shortest = None
+        for code in _query_codes(needle):
+            index = bisect_left(self._codes, code)
+            if index == len(self._codes) or self._codes[index] != code:
+                # 含まれない断片がある
+                return ()
+            span = (self._offsets[index], self._offsets[index + 1])
+            if shortest is None or span[1] - span[0] < shortest[1] - shortest[0]:
+                shortest = span
+        return memoryview(self._postings)[shortest[0]:shortest[1]]
+
+    def search(self, query, limit=AUTOCOMPLETE_RESULTS):
+        """`query` を含むタイトルをレビュー件数の多い順に最大 `limit` 件返す。"""
+
+        needle = normalize(query)
+        if not needle:
+            return []
+
+        with self._lock:
+            tombstones = set(self._tombstones)
+            delta = list(self._delta.items())
+
+        text = self._text
+        starts = self._starts
+        # 2 文字までは断片の一覧がそのまま一致の一覧になる
+        verify = len(needle) > 2
+        # (レビュー件数, 前方一致, 書籍ID, タイトル)
+        matches = []
+        # limit 件目の件数と、それより上に並ぶことが確定した件数
+        floor = None
+        ahead = 0
+        for rank in self._candidates(needle):
+            review_count = self._counts[rank]
+            start = starts[rank]
+            if floor is not None:
+                # 候補は件数の多い順（同数なら ID の大きい順）なので、limit 件目と同数の残りは
+                # 前方一致のものだけが順位を上げうる。件数が下がったら以降は入らない
+                if review_count < floor or ahead >= limit:
+                    break
+                if not text.startswith(needle, start) or self._ids[rank] in tombstones:
+                    continue
+                matches.append((review_count, True, self._ids[rank], self._titles[rank]))
+                ahead += 1
+                continue
+            book_id = self._ids[rank]
+            if book_id in tombstones:
+                continue
+            if verify and text.find(needle, start, starts[rank + 1] - 1) == -1:
+                continue
+            matches.append((review_count, text.startswith(needle, start), book_id, self._titles[rank]))
+            if len(matches) == limit:
+                floor = review_count
+                ahead = sum(1 for count, prefix, _, _ in matches if count > floor or prefix)
+        for book_id, (title, normalized, review_count) in delta:
+            if needle in normalized:
+                matches.append((review_count, normalized.startswith(needle), book_id, title))
+
+        # レビュー件数 → 前方一致 → 新しい書籍 の順に並べる
+        matches.sort(key=lambda match: match[:3], reverse=True)
+        return [
+            {'id': book_id, 'title': title, 'review_count': review_count}
+            for review_count, _, book_id, title in matches[:limit]
+        ]
+
+    def upsert(self, book_id, title, review_count=None):
+        """書籍の追加・タイトル変更を反映する。review_count が None なら今の件数を引き継ぐ。"""
+
+        with self._lock:
+            if review_count is None:
+                review_count = self._review_count(book_id)
+            if self._rank(book_id) is not None:
+                self._tombstones.add(book_id)
+            self._delta[book_id] = (title, normalize(title), review_count)
+
+    def remove(self, book_id):
+        """削除された書籍を候補から外す。"""
+
+        with self._lock:
+            self._delta.pop(book_id, None)
+            if self._rank(book_id) is not None:
+                self._tombstones.add(book_id)
+
+    def add_reviews(self, book_id, amount):
+        """レビューの投稿・削除に合わせてレビュー件数を増減する。
+
+        転置リストの並び順を崩さないよう、作成時に含まれる書籍は差分領域に移してから数え直す。
+        """
+
+        with self._lock:
+            if book_id in self._delta:
+                title, normalized, review_count = self._delta[book_id]
+                self._delta[book_id] = (title, normalized, max(review_count + amount, 0))
+                return
+            rank = self._rank(book_id)
+            if rank is None or book_id in self._tombstones:
+                return
+            self._tombstones.add(book_id)
+            normalized = self._text[self._starts[rank]:self._starts[rank + 1] - 1]
+            self._delta[book_id] = (self._titles[rank], normalized, max(self._counts[rank] + amount, 0))
+
+    def refresh(self, book_ids):
+        """`book_ids` の書籍を DB から読み直して反映する。無くなった書籍は外す。"""
+
+        found = set()
+        for book_id, title, review_count in _database_rows(book_ids):
+            found.add(book_id)
+            self.upsert(book_id, title, review_count)
+        for book_id in set(book_ids) - found:
+            self.remove(book_id)
+
+    def _review_count(self, book_id):
+        if book_id in self._delta:
+            return self._delta[book_id][2]
+        rank = self._rank(book_id)
+        return self._counts[rank] if rank is not None and book_id not in self._tombstones else 0
+
+
+def _database_rows(book_ids=None):
+    """(書籍ID, タイトル, レビュー件数) を返す。レビュー件数は評価分布の表から取る（Review の集計はしない）。"""
+
+    books = Book.objects.all()
+    if book_ids is not None:
+        books = books.filter(pk__in=list(book_ids))
+    return (
+        books.annotate(review_count=Coalesce('rating_histogram__review_count', Value(0)))
+        .values_list('id', 'title', 'review_count')
+        .iterator(chunk_size=2000)
+    )
+
+
+_index = None
+# _index の差し替えと _touched の読み書き
+_lock = threading.Lock()
+# 作成は同時に 1 つだけ
+_build_lock = threading.Lock()
+# 作成中に保存・削除された書籍ID。作成中でなければ None
+_touched = None
+
+
+def build_title_index():
+    """DB からインデックスを作って差し替える（完了まで待つ）。"""
+
+    with _build_lock:
+        return _build()
+
+
+def _build():
+    """呼び出し側が _build_lock を持っていること。作成中に変わった書籍も反映してから差し替える。"""
+
+    global _index, _touched
+    with _lock:
+        _touched = set()
+    try:
+        index = TitleIndex.from_database()
+        while True:
+            with _lock:
+                touched, _touched = _touched, set()
+                if not touched:
+                    _index = index
+                    return index
+            # DB の読み直しはロックの外で行い、その間の変更は次の周回で拾う
+            index.refresh(touched)
+    finally:
+        with _lock:
+            _touched = None
+
+
+def _build_in_background():
+    try:
+        _build()
+    except Exception:
+        logger.warning('入力補完のインデックスを作成できませんでした', exc_info=True)
+    finally:
+        _build_lock.release()
+        # このスレッドで開いた DB 接続を閉じる
+        connections.close_all()
+
+
+def start_rebuild():
+    """バックグラウンドでの作り直しを始める。既に作成中なら何もしない。"""
+
+    # ロックはスレッド側で作成が終わったときに外す
+    if not _build_lock.acquire(blocking=False):
+        return False
+    try:
+        threading.Thread(target=_build_in_background, name='title-index', daemon=True).start()
+    except BaseException:
+        _build_lock.release()
+        raise
+    return True
+
+
+def get_title_index():
+    """ワーカー内のインデックスを返す。未作成なら None。
+
+    未作成・古い・差分過多のときはバックグラウンドでの作り直しを始める（完了を待たない）。
+    """
+
+    index = _index
+    if index is None or index.is_stale:
+        start_rebuild()
+    return index
+
+
+def search_titles(query, limit=AUTOCOMPLETE_RESULTS):
+    """入力補完の候補を返す。インデックスの作成が終わるまでは DB を部分一致で検索する。"""
+
+    index = get_title_index()
+    if index is not None:
+        return index.search(query, limit)
+    query = query.strip()
+    if not query:
+        return []
+    rows = (
+        Book.objects.filter(title__icontains=query)
+        .annotate(review_count=Coalesce('rating_histogram__review_count', Value(0)))
+        .order_by(F('review_count').desc(), '-id')
+        .values_list('id', 'title', 'review_count')[:limit]
+    )
+    return [{'id': book_id, 'title': title, 'review_count': review_count} for book_id, title, review_count in rows]
+
+
+def _apply(book_id, change):
+    """作成済みのインデックスに変更を反映し、作成中なら書籍IDを控える。"""
+
+    with _lock:
+        index = _index
+        if _touched is not None:
+            _touched.add(book_id)
+    # まだ作成されていないワーカーでは、作成時に DB から読むので何もしない
+    if index is not None:
+        change(index)
+
+
+def book_saved(book_id, title):
+    _apply(book_id, lambda index: index.upsert(book_id, title))
+
+
+def book_deleted(book_id):
+    _apply(book_id, lambda index: index.remove(book_id))
+
+
+def reviews_changed(book_id, amount):
+    _apply(book_id, lambda index: index.add_reviews(book_id, amount))
+
+
+def books_refreshed(book_ids):
+    """シグナルを通さずに変えた書籍（管理画面の一括削除など）を DB から読み直して反映する。"""
+
+    book_ids = set(book_ids)
+    with _lock:
+        index = _index
+        if _touched is not None:
+            _touched.update(book_ids)
+    if index is not None:
+        index.refresh(book_ids)
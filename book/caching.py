@@ -0,0 +1,70 @@
+"""読み取りの重い処理の結果をキャッシュするためのヘルパー。
+
+キャッシュキーには「コンテンツのバージョン」を含める。書籍やレビューが変わるたびに
+バージョンを新しい値に差し替えるので、古いキャッシュを個別に消さなくても次の読み出しから
+新しいキーが使われる（古いキーは有効期限切れで消える）。
+
+バージョンを全ワーカーで共有できないと、書き込みを処理したワーカー以外は古い結果を
+返し続けてしまう。そのためワーカー間で共有されるキャッシュ（settings.SHARED_CACHE）が
+設定されていないときは、結果をキャッシュせず毎回 builder() を呼ぶ。
+"""
+
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .consts import READ_CACHE_TIMEOUT
+
+CONTENT_VERSION_KEY = 'book:content-version'
+_MISSING = object()
+
+
+def _new_version():
+    return uuid.uuid4().hex[:12]
+
+
+def content_version():
+    """現在のコンテンツのバージョン。"""
+
+    version = cache.get(CONTENT_VERSION_KEY)
+    if version is None:
+        cache.add(CONTENT_VERSION_KEY, _new_version(), None)
+        version = cache.get(CONTENT_VERSION_KEY)
+    return version
+
+
+def bump_content_version():
+    """書籍・レビューの変更時に呼び、既存のキャッシュキーをまとめて無効にする。
+
+    incr で数を進めるのではなく毎回新しい値で上書きする。DB キャッシュの incr は
+    読み出しと書き込みが別なので、同時に進めると 1 回分が失われることがあるため。
+    """
+
+    cache.set(CONTENT_VERSION_KEY, _new_version(), None)
+
+
+def shared_cache_enabled():
+    return settings.SHARED_CACHE
+
+
+def make_key(name, *parts):
+    digest = hashlib.sha256(repr(parts).encode()).hexdigest()[:24]
+    return f'book:{name}:v{content_version()}:{digest}'
+
+
+def cached(name, builder, *parts, timeout=READ_CACHE_TIMEOUT):
+    """`name` と `parts` ごとに builder() の結果をキャッシュして返す。
+
+    キャッシュがワーカー間で共有されていなければ、キャッシュせずに builder() の結果を返す。
+    """
+
+    if not shared_cache_enabled():
+        return builder()
+    key = make_key(name, *parts)
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        value = builder()
+        cache.set(key, value, timeout)
+    return value
@@ -1,2 +1,38 @@
-MAX_RATE = 5
-ITEM_PER_PAGE = 10
\ No newline at end of file
+MAX_RATE = 5
+ITEM_PER_PAGE = 10
+
+# 閲覧数カウンター：ワーカー内のバッファを書き出す間隔（秒）と件数のしきい値
+VIEW_COUNT_FLUSH_INTERVAL = 30
+VIEW_COUNT_FLUSH_SIZE = 200
+
+# 人気ランキング：集計対象の日数、閲覧数の重みが半分になる日数、トップページの表示件数
+TRENDING_WINDOW_DAYS = 14
+TRENDING_HALF_LIFE_DAYS = 3
+TRENDING_SIZE = 10
+
+# タイトル入力補完：返す候補数の既定値と上限、ワーカー内インデックスを作り直す間隔（秒）
+AUTOCOMPLETE_RESULTS = 8
+AUTOCOMPLETE_MAX_RESULTS = 20
+AUTOCOMPLETE_REBUILD_INTERVAL = 300
+
+# sitemap：1 ファイルあたりの URL 数（書籍ID の範囲で分割）、Atom フィード：書籍・レビューそれぞれの件数
+SITEMAP_CHUNK_SIZE = 5000
+FEED_SIZE = 50
+
+# 管理画面の件数表示：キャッシュする秒数と、PostgreSQL の推定件数を使い始める件数
+ADMIN_COUNT_CACHE_TIMEOUT = 60
+ADMIN_ESTIMATE_THRESHOLD = 10000
+# 管理画面のレビュー一括削除で 1 回に削除する件数
+ADMIN_DELETE_BATCH_SIZE = 1000
+
+# アクティビティのタイムライン：保持する件数（全体／ユーザーごと）とトップページの表示件数
+GLOBAL_TIMELINE_SIZE = 200
+USER_TIMELINE_SIZE = 100
+TIMELINE_PAGE_SIZE = 10
+
+# 読み取り系のキャッシュ（カテゴリ一覧・ランキングなど）の有効期限（秒）
+READ_CACHE_TIMEOUT = 600
+
+# ワーカーの起動から最初のリクエストを返すまでの許容時間（秒）。startup_profile と
+# 回帰テスト（RUN_BENCHMARKS=1 のときだけ実行）で使う
+STARTUP_TIME_BUDGET = 2.0
@@ -0,0 +1,184 @@
+"""クローラー向けの sitemap と Atom フィードを生成する。
+
+書籍一覧（/book/）を全件描画させる代わりに、書籍ID の範囲ごとに分割した sitemap と
+新着フィードを用意する。どちらも `.iterator()` で少しずつ読み出して文字列を yield する
+ジェネレーターなので、StreamingHttpResponse にもファイル書き出しにもそのまま使える。
+"""
+
+import heapq
+from xml.sax.saxutils import escape, quoteattr
+
+from django.db.models import F, IntegerField, Max
+from django.db.models.functions import Cast
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.text import Truncator
+
+from .caching import cached
+from .consts import FEED_SIZE, SITEMAP_CHUNK_SIZE
+from .models import Book, ContentChange, Review
+
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+# ジェネレーターの細かい文字列をまとめて返す単位（文字数）
+BUFFER_SIZE = 32 * 1024
+
+
+def _w3c(value):
+    return timezone.localtime(value).isoformat(timespec='seconds')
+
+
+def buffered(chunks, size=BUFFER_SIZE):
+    """小さな文字列を `size` 文字程度にまとめて yield する。"""
+
+    parts = []
+    length = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(parts)
+            parts = []
+            length = 0
+    if parts:
+        yield ''.join(parts)
+
+
+def sitemap_chunks(chunk_size=SITEMAP_CHUNK_SIZE):
+    """(分割番号, その範囲の最終更新日時) のリストを分割番号順に返す。書籍の無い範囲は含まない。
+
+    書籍を全件読む集計なので、結果はコンテンツのバージョンごとにキャッシュする。
+    """
+
+    def build():
+        # 書籍ID を chunk_size ごとに区切った番号で GROUP BY する（整数の割り算）
+        chunk = Cast((F('id') - 1) / chunk_size, IntegerField())
+        return list(
+            Book.objects.order_by()
+            .annotate(chunk=chunk)
+            .values_list('chunk')
+            .annotate(lastmod=Max('updated_at'))
+            .order_by('chunk')
+        )
+
+    return cached('sitemap-chunks', build, chunk_size)
+
+
+def latest_update(reviews=False):
+    """書籍（reviews=True ならレビューも）の最終更新日時。無ければ None。
+
+    削除は残った行の updated_at を動かさないので、最後に削除した日時（ContentChange）も含める。
+    updated_at の索引の端と主キーで 1 行を読むだけなので、件数が増えても全件は読まない。
+    """
+
+    candidates = [
+        Book.objects.aggregate(latest=Max('updated_at'))['latest'],
+        ContentChange.objects.filter(name=ContentChange.DELETED).values_list('changed_at', flat=True).first(),
+    ]
+    if reviews:
+        candidates.append(Review.objects.aggregate(latest=Max('updated_at'))['latest'])
+    return max((value for value in candidates if value is not None), default=None)
+
+
+def sitemap_chunk_url(chunk):
+    return reverse('book:sitemap-books', kwargs={'chunk': chunk})
+
+
+def iter_sitemap_index(base_url, chunk_size=SITEMAP_CHUNK_SIZE):
+    """sitemap index（各分割ファイルへのリンク集）を生成する。"""
+
+    yield f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{SITEMAP_NS}">\n'
+    for chunk, lastmod in sitemap_chunks(chunk_size):
+        yield (
+            f'<sitemap><loc>{escape(base_url + sitemap_chunk_url(chunk))}</loc>'
+            f'<lastmod>{_w3c(lastmod)}</lastmod></sitemap>\n'
+        )
+    yield '</sitemapindex>\n'
+
+
+def iter_sitemap_chunk(base_url, chunk, chunk_size=SITEMAP_CHUNK_SIZE):
+    """`chunk` 番目の範囲に含まれる書籍の詳細ページを列挙する。"""
+
+    first_id = chunk * chunk_size + 1
+    books = (
+        Book.objects.filter(id__gte=first_id, id__lt=first_id + chunk_size)
+        .order_by('id')
+        .values_list('id', 'updated_at')
+    )
+    yield f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{SITEMAP_NS}">\n'
+    for book_id, updated_at in books.iterator(chunk_size=2000):
+        loc = base_url + reverse('book:detail-book', kwargs={'pk': book_id})
+        yield f'<url><loc>{escape(loc)}</loc><lastmod>{_w3c(updated_at)}</lastmod></url>\n'
+    yield '</urlset>\n'
+
+
+def _book_entries(base_url, limit):
+    books = (
+        Book.objects.select_related('user')
+        .order_by('-created_at')
+        .only('id', 'title', 'text', 'created_at', 'updated_at', 'user__username')[:limit]
+    )
+    for book in books.iterator():
+        url = base_url + reverse('book:detail-book', kwargs={'pk': book.pk})
+        yield book.created_at, {
+            'id': url,
+            'url': url,
+            'title': f'新着書籍：{book.title}',
+            'author': book.user.username,
+            'updated': book.updated_at,
+            'published': book.created_at,
+            'summary': Truncator(book.text).chars(120),
+        }
+
+
+def _review_entries(base_url, limit):
+    reviews = (
+        Review.objects.select_related('user', 'book')
+        .order_by('-created_at')
+        .only('id', 'title', 'text', 'rate', 'created_at', 'updated_at', 'book__title', 'user__username')[:limit]
+    )
+    for review in reviews.iterator():
+        url = base_url + reverse('book:detail-book', kwargs={'pk': review.book_id})
+        yield review.created_at, {
+            'id': f'{url}#review-{review.pk}',
+            'url': f'{url}#review-{review.pk}',
+            'title': f'レビュー：{review.book.title}「{review.title}」（{review.rate}点）',
+            'author': review.user.username,
+            'updated': review.updated_at,
+            'published': review.created_at,
+            'summary': Truncator(review.text).chars(120),
+        }
+
+
+def iter_atom_feed(base_url, limit=FEED_SIZE):
+    """新着の書籍とレビューを投稿日時の新しい順に並べた Atom フィードを生成する。"""
+
+    # 書籍・レビューはそれぞれ新しい順に読み出されるので、heapq.merge で並べ替えずに合流させる
+    entries = heapq.merge(
+        _book_entries(base_url, limit),
+        _review_entries(base_url, limit),
+        key=lambda item: item[0],
+        reverse=True,
+    )
+    feed_url = base_url + reverse('book:feed')
+    latest = latest_update(reviews=True) or timezone.now()
+
+    yield (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n<feed xmlns="{ATOM_NS}">\n'
+        f'<title>IT Bookfolio 新着書籍・レビュー</title>\n'
+        f'<id>{escape(feed_url)}</id>\n'
+        f'<link rel="self" href={quoteattr(feed_url)}/>\n'
+        f'<link href={quoteattr(base_url + reverse("book:index"))}/>\n'
+        f'<updated>{_w3c(latest)}</updated>\n'
+    )
+    for _, entry in entries:
+        yield (
+            f'<entry><id>{escape(entry["id"])}</id>'
+            f'<title>{escape(entry["title"])}</title>'
+            f'<link href={quoteattr(entry["url"])}/>'
+            f'<author><name>{escape(entry["author"])}</name></author>'
+            f'<published>{_w3c(entry["published"])}</published>'
+            f'<updated>{_w3c(entry["updated"])}</updated>'
+            f'<summary>{escape(entry["summary"])}</summary></entry>\n'
+        )
+    yield '</feed>\n'
@@ -0,0 +1,90 @@
+"""書籍ごとの評価分布（RatingHistogram）の差分更新と一括再計算。"""
+
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from .models import RatingHistogram, Review
+
+
+def _adjusted(field, amount):
+    # 同じレビューの同時編集や bulk_create / update(rate=...) で分布がずれていることがある。
+    # 減算で 0 を下回ると PositiveIntegerField の制約違反になるので 0 で止める
+    # （ずれ自体は rebuild_rating_histograms で直す）
+    if amount < 0:
+        return Greatest(F(field) + amount, 0)
+    return F(field) + amount
+
+
+def add_rating(book_id, rate, amount):
+    """`rate` 点のレビューを `amount` 件増減する。UPDATE 1 回で加算するので競合しない。"""
+
+    updates = {
+        f'rate_{rate}': _adjusted(f'rate_{rate}', amount),
+        'review_count': _adjusted('review_count', amount),
+        'rate_total': _adjusted('rate_total', rate * amount),
+    }
+    if RatingHistogram.objects.filter(book_id=book_id).update(**updates):
+        return
+    # 減算で行が無いのは書籍ごと削除中のケース。行を作り直さない
+    if amount > 0:
+        RatingHistogram.objects.get_or_create(book_id=book_id)
+        RatingHistogram.objects.filter(book_id=book_id).update(**updates)
+
+
+def expected_histograms(book_ids=None):
+    """Review を 1 回の GROUP BY で集計し、書籍ID → 点数ごとの件数 を返す。"""
+
+    reviews = Review.objects.all()
+    if book_ids is not None:
+        reviews = reviews.filter(book_id__in=book_ids)
+    expected = defaultdict(lambda: [0] * len(RatingHistogram.RATE_FIELDS))
+    rows = (
+        reviews.order_by()
+        .values_list('book_id', 'rate')
+        .annotate(n=Count('id'))
+    )
+    for book_id, rate, n in rows.iterator():
+        expected[book_id][rate] = n
+    return expected
+
+
+def _fill(histogram, counts):
+    for name, count in zip(RatingHistogram.RATE_FIELDS, counts):
+        setattr(histogram, name, count)
+    histogram.review_count = sum(counts)
+    histogram.rate_total = sum(rate * count for rate, count in enumerate(counts))
+    return histogram
+
+
+def rebuild_histograms(book_ids=None, dry_run=False):
+    """集計結果と食い違う分布を書き直し、(作成件数, 修正件数) を返す。
+
+    `book_ids` を指定した場合はその書籍だけを対象にする。
+    """
+
+    expected = expected_histograms(book_ids)
+    existing = RatingHistogram.objects.all()
+    if book_ids is not None:
+        existing = existing.filter(book_id__in=book_ids)
+
+    empty = [0] * len(RatingHistogram.RATE_FIELDS)
+    to_update = []
+    for histogram in existing.iterator():
+        counts = expected.pop(histogram.book_id, empty)
+        if histogram.counts != counts:
+            to_update.append(_fill(histogram, counts))
+    # 残ったものは分布の行がまだ無い書籍
+    to_create = [_fill(RatingHistogram(book_id=book_id), counts) for book_id, counts in expected.items()]
+
+    if not dry_run:
+        with transaction.atomic():
+            RatingHistogram.objects.bulk_update(
+                to_update,
+                RatingHistogram.RATE_FIELDS + ['review_count', 'rate_total'],
+                batch_size=500,
+            )
+            RatingHistogram.objects.bulk_create(to_create, batch_size=500)
+    return len(to_create), len(to_update)
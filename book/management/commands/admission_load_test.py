@@ -0,0 +1,152 @@
+import itertools
+import logging
+import threading
+import time
+from collections import defaultdict
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from book import admission, queries
+from book.viewcounts import view_counter
+
+# 重いルートの検索語。多くの書籍に部分一致する短い語にする
+SEARCH_WORDS = ('a', 'e', 'の', 'Python', 'デザイン')
+# 503 を受けたクライアントが次に送るまでの間隔（秒）。実際のブラウザーと同じく即座には再送しない
+REJECTED_BACKOFF = 0.1
+
+
+def percentile(sorted_values, rate):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * rate))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    """流入制御の負荷試験。重いルートを溢れさせながら、軽いルートの応答時間を測る。
+
+    プロセス内のテストクライアントを複数スレッドから呼ぶので、流入制御の効果
+    （軽いルートの p99 が重いルートの混雑に引きずられないこと）を 1 プロセスで確かめられる。
+    """
+
+    help = '流入制御の有無で、重いルートが混雑したときの軽いルートの p50 / p99 を比べます。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=5.0, help='各フェーズの秒数')
+        parser.add_argument('--cheap-clients', type=int, default=4, help='軽いルート（書籍詳細）を叩く並列数')
+        parser.add_argument('--expensive-clients', type=int, default=16, help='重いルート（検索）を叩く並列数')
+        parser.add_argument('--username', help='リクエストに使うユーザー（省略時は最初のスーパーユーザー）')
+
+    def handle(self, *args, **options):
+        user = self._user(options['username'])
+        client = Client()
+        client.force_login(user)
+        self.session_key = client.cookies[settings.SESSION_COOKIE_NAME].value
+
+        book_ids = queries.most_reviewed_book_ids(20) or list(
+            queries.search_books().values_list('pk', flat=True)[:20]
+        )
+        if not book_ids:
+            raise CommandError('書籍がありません')
+        self.cheap_paths = [reverse('book:detail-book', kwargs={'pk': pk}) for pk in book_ids]
+
+        phases = [
+            ('軽いルートのみ', True, 0),
+            ('過負荷・流入制御なし', False, options['expensive_clients']),
+            ('過負荷・流入制御あり', True, options['expensive_clients']),
+        ]
+        # 503 のたびに django.request のエラーログが出るので、試験中は止めておく
+        request_logger = logging.getLogger('django.request')
+        request_logger.disabled = True
+        try:
+            self.run_phases(phases, options)
+        finally:
+            request_logger.disabled = False
+
+    def run_phases(self, phases, options):
+        for label, enabled, expensive_clients in phases:
+            results = self.run_phase(enabled, options['duration'], options['cheap_clients'], expensive_clients)
+            self.report(label, results, options['duration'])
+            if enabled and expensive_clients:
+                for name, tier in admission.stats().items():
+                    self.stdout.write(
+                        f'    [{name}] 受付 {tier["admitted"]} / 待機 {tier["queued"]} / '
+                        f'拒否 {tier["rejected"]}（うち待ち時間切れ {tier["timed_out"]}）/ 最大待ち行列 {tier["max_waiting"]}'
+                    )
+
+    def _user(self, username):
+        User = get_user_model()
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'ユーザー「{username}」が見つかりません')
+        user = User.objects.filter(is_superuser=True).order_by('pk').first()
+        if user is None:
+            raise CommandError('スーパーユーザーがいません。--username でユーザーを指定してください')
+        return user
+
+    def run_phase(self, enabled, duration, cheap_clients, expensive_clients):
+        """スレッドを起動して `duration` 秒間リクエストを送り、種類ごとの (応答時間, ステータス) を返す。"""
+
+        results = defaultdict(list)
+        lock = threading.Lock()
+        counter = itertools.count()
+
+        # 負荷試験のアクセスは閲覧数に数えない
+        with override_settings(ADMISSION_CONTROL=enabled), mock.patch.object(view_counter, 'record'):
+            admission.reset_tiers()
+            deadline = time.monotonic() + duration
+
+            def worker(kind):
+                client = Client()
+                client.cookies[settings.SESSION_COOKIE_NAME] = self.session_key
+                samples = []
+                try:
+                    while time.monotonic() < deadline:
+                        n = next(counter)
+                        if kind == 'cheap':
+                            path = self.cheap_paths[n % len(self.cheap_paths)]
+                        else:
+                            # 共有キャッシュに当たらないよう、毎回異なるパラメーターを付ける
+                            word = SEARCH_WORDS[n % len(SEARCH_WORDS)]
+                            base = reverse('book:index') if n % 2 else reverse('book:list-book')
+                            path = f'{base}?q={word}&n={n}'
+                        started = time.perf_counter()
+                        response = client.get(path)
+                        b''.join(response)
+                        samples.append((time.perf_counter() - started, response.status_code))
+                        if response.status_code == 503:
+                            time.sleep(REJECTED_BACKOFF)
+                finally:
+                    connections.close_all()
+                with lock:
+                    results[kind].extend(samples)
+
+            threads = [threading.Thread(target=worker, args=('cheap',)) for _ in range(cheap_clients)]
+            threads += [threading.Thread(target=worker, args=('expensive',)) for _ in range(expensive_clients)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return results
+
+    def report(self, label, results, duration):
+        self.stdout.write(self.style.MIGRATE_HEADING(label))
+        for kind in ('cheap', 'expensive'):
+            samples = results.get(kind)
+            if not samples:
+                continue
+            ok = sorted(latency for latency, status in samples if status == 200)
+            rejected = sum(1 for _, status in samples if status == 503)
+            self.stdout.write(
+                f'  {kind:<9} {len(samples):5d}件 ({len(samples) / duration:6.1f}件/秒)  '
+                f'503: {rejected:4d}件  p50 {percentile(ok, 0.5) * 1000:7.1f}ms  '
+                f'p99 {percentile(ok, 0.99) * 1000:7.1f}ms'
+            )
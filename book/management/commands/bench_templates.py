@@ -0,0 +1,130 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.template import engines
+from django.template.utils import EngineHandler
+from django.test import RequestFactory
+from django.urls import resolve
+from django.utils import timezone
+
+from book.models import Book, CATEGORY, RatingHistogram, Review, TimelineEntry
+
+
+class Command(BaseCommand):
+    """DTL と Jinja2 で一覧・詳細・トップページの描画時間を比べるマイクロベンチマーク。
+
+    DB には書き込まず、メモリ上に作った書籍・レビューでテンプレートだけを描画する。
+    """
+
+    help = '擬似データの書籍カタログで DTL と Jinja2 の描画時間を比較します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=200, help='一覧・トップに並べる書籍数')
+        parser.add_argument('--reviews', type=int, default=50, help='詳細ページのレビュー数')
+        parser.add_argument('--repeat', type=int, default=50, help='各テンプレートの描画回数')
+
+    def handle(self, *args, **options):
+        if settings.JINJA2_ENGINE is None:
+            raise CommandError('Jinja2 がインストールされていません（pip install Jinja2）')
+        # Jinja2 を使うビューが無ければエンジンは未登録なので、同じ設定でここで作る
+        if 'jinja2' in engines.templates:
+            jinja2_engine = engines['jinja2']
+        else:
+            jinja2_engine = EngineHandler([settings.JINJA2_ENGINE])['jinja2']
+        compared = {'django': engines['django'], 'jinja2': jinja2_engine}
+
+        user = User(pk=1, username='benchmark')
+        books = self.seed_books(options['books'], user)
+        cases = {
+            'index': ('/', 'book/index.html', self.index_context(books)),
+            'list-book': ('/book/', 'book/book_list.html', self.list_context(books)),
+            'detail-book': (
+                f'/book/{books[0].pk}/detail/', 'book/book_detail.html',
+                self.detail_context(books[0], options['reviews'], user),
+            ),
+        }
+
+        self.stdout.write(f'書籍 {len(books)}冊 / レビュー {options["reviews"]}件 / {options["repeat"]}回の平均')
+        for name, (path, template_name, context) in cases.items():
+            request = RequestFactory().get(path)
+            request.user = user
+            request.resolver_match = resolve(path)
+            timings = {}
+            for engine_name, engine in compared.items():
+                template = engine.get_template(template_name)
+                # 初回はコンパイルやキャッシュ作成を含むので計測から外す
+                template.render(dict(context), request)
+                started = time.perf_counter()
+                for _ in range(options['repeat']):
+                    template.render(dict(context), request)
+                timings[engine_name] = (time.perf_counter() - started) * 1000 / options['repeat']
+            ratio = timings['django'] / timings['jinja2']
+            self.stdout.write(
+                f'  {name:<12} DTL {timings["django"]:7.2f} ms   Jinja2 {timings["jinja2"]:7.2f} ms   ({ratio:.1f}倍)'
+            )
+
+    def seed_books(self, count, user):
+        now = timezone.now()
+        books = []
+        for i in range(1, count + 1):
+            book = Book(
+                pk=i,
+                title=f'ベンチマーク用の書籍 {i}',
+                text='紹介文です。' * 20,
+                category=CATEGORY[i % len(CATEGORY)][0],
+                thumbnail=f'bench-{i}.jpg' if i % 3 else None,
+                user=user,
+                created_at=now,
+                updated_at=now,
+            )
+            book.avg_rating = 3 + (i % 20) / 10
+            book.review_count = i % 7 + 1
+            book.rating_histogram = RatingHistogram(book=book, rate_3=1, rate_4=i % 5, rate_5=i % 3)
+            books.append(book)
+        return books
+
+    def common_context(self):
+        return {
+            'categories': [{'value': value, 'label': label} for value, label in CATEGORY],
+            'current_query': '',
+            'current_category': '',
+            'current_category_label': '',
+            # ユーザーごとの部品は目印のまま描画する（共有キャッシュに載る本文だけを比べる）
+            'shared_page': True,
+        }
+
+    def index_context(self, books):
+        entries = [
+            TimelineEntry(
+                kind=TimelineEntry.KIND_REVIEW, book_id=book.pk, review_id=book.pk,
+                actor_name='benchmark', book_title=book.title, review_title='感想', rate=4,
+                created_at=book.created_at,
+            )
+            for book in books[:10]
+        ]
+        return {
+            **self.common_context(),
+            'object_list': books,
+            'ranking_list': books[:10],
+            'trending_list': books[:10],
+            'recent_activity': entries,
+        }
+
+    def list_context(self, books):
+        return {**self.common_context(), 'object_list': books, 'total_books': len(books)}
+
+    def detail_context(self, book, count, user):
+        reviews = [
+            Review(pk=i, book=book, title=f'レビュー {i}', text='とても良い本でした。\n' * 3, rate=i % 6, user=user)
+            for i in range(1, count + 1)
+        ]
+        return {
+            'object': book,
+            'book': book,
+            'reviews': reviews,
+            'shared_page': True,
+            'rating_histogram': book.rating_histogram,
+            'rating_distribution': book.rating_histogram.distribution(),
+        }
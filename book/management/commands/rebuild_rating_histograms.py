@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from book.histograms import rebuild_histograms
+
+
+class Command(BaseCommand):
+    """評価分布の整合性チェック。Review を一括集計して食い違いを直す。"""
+
+    help = 'Review を 1 回の GROUP BY で集計し、書籍ごとの評価分布と食い違う行を作成・修正します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='修正せず、食い違いの件数だけを表示する')
+
+    def handle(self, *args, **options):
+        created, updated = rebuild_histograms(dry_run=options['dry_run'])
+        prefix = '（dry-run）' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(f'{prefix}評価分布：作成 {created}件／修正 {updated}件'))
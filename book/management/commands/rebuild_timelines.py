@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from book.timeline import rebuild
+
+
+class Command(BaseCommand):
+    """アクティビティのタイムラインを Book / Review から作り直す。"""
+
+    help = '全体・ユーザーごとのタイムラインを削除し、書籍とレビューから作り直します。'
+
+    def handle(self, *args, **options):
+        written = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'タイムラインを作り直しました（{written}件）'))
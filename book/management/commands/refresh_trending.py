@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from book.trending import TRENDING_STORE_SIZE, refresh_trending
+from book.viewcounts import view_counter
+
+
+class Command(BaseCommand):
+    """閲覧数から人気ランキングを再計算する。cron などで定期実行する想定。"""
+
+    help = '日別閲覧数から時間減衰スコアを計算し、人気ランキングのテーブルを更新します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=TRENDING_STORE_SIZE, help='保存する上位件数')
+
+    def handle(self, *args, **options):
+        # このプロセスに残っている閲覧数も反映してから集計する
+        view_counter.flush()
+        saved = refresh_trending(limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(f'人気ランキングを更新しました（{saved}件）'))
@@ -0,0 +1,45 @@
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from book.feeds import buffered, iter_atom_feed, iter_sitemap_chunk, iter_sitemap_index, sitemap_chunks
+
+
+class Command(BaseCommand):
+    """sitemap と Atom フィードをファイルに事前生成する。生成済みのファイルはビューがそのまま返す。"""
+
+    help = 'sitemap index・分割 sitemap・Atom フィードを SITEMAP_ROOT に書き出します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', required=True, help='URL の先頭部分（例: https://example.com）')
+        parser.add_argument('--output-dir', default=None, help='出力先（既定: settings.SITEMAP_ROOT）')
+
+    def handle(self, *args, **options):
+        base_url = options['base_url'].rstrip('/')
+        output_dir = Path(options['output_dir'] or settings.SITEMAP_ROOT)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        written = {'sitemap.xml', 'feed.atom'}
+        self._write(output_dir / 'sitemap.xml', iter_sitemap_index(base_url))
+        for chunk, _ in sitemap_chunks():
+            name = f'sitemap-books-{chunk}.xml'
+            self._write(output_dir / name, iter_sitemap_chunk(base_url, chunk))
+            written.add(name)
+        self._write(output_dir / 'feed.atom', iter_atom_feed(base_url))
+
+        # 書籍が削除されて不要になった分割ファイルは消しておく
+        for path in output_dir.glob('sitemap-books-*.xml'):
+            if path.name not in written:
+                path.unlink()
+
+        self.stdout.write(self.style.SUCCESS(f'{len(written)}ファイルを {output_dir} に書き出しました'))
+
+    def _write(self, path, chunks):
+        # 書きかけのファイルを配信しないよう、一時ファイルに書いてから置き換える
+        tmp_path = path.with_name(path.name + '.tmp')
+        with tmp_path.open('w', encoding='utf-8') as f:
+            for chunk in buffered(chunks):
+                f.write(chunk)
+        os.replace(tmp_path, path)
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from book.models import SlowQuery
+
+
+class Command(BaseCommand):
+    """SlowQueryMiddleware が記録した遅いクエリを、合計時間の長い順に表示する。"""
+
+    help = '記録された遅いクエリを合計時間の長い順に表示します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=10, help='表示する件数')
+        parser.add_argument('--explain', action='store_true', help='実行計画も表示する')
+        parser.add_argument('--reset', action='store_true', help='表示後に記録を消去する')
+
+    def handle(self, *args, **options):
+        queries = SlowQuery.objects.order_by('-total_time')[:options['limit']]
+        if not queries:
+            self.stdout.write('記録された遅いクエリはありません')
+        for rank, query in enumerate(queries, 1):
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'#{rank} 合計 {query.total_time:.1f}ms / {query.calls}回 '
+                f'（平均 {query.average_time:.1f}ms・最大 {query.max_time:.1f}ms）'
+            ))
+            location = query.view + (f'（{query.template}）' if query.template else '')
+            self.stdout.write(f'  呼び出し元: {location}')
+            self.stdout.write(f'  SQL: {query.sql}')
+            self.stdout.write(f'  例: {query.example_params}')
+            if options['explain'] and query.explain:
+                self.stdout.write('  実行計画:')
+                for line in query.explain.splitlines():
+                    self.stdout.write(f'    {line}')
+
+        if options['reset']:
+            deleted, _ = SlowQuery.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f'{deleted}件の記録を消去しました'))
@@ -0,0 +1,58 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from book.consts import STARTUP_TIME_BUDGET
+from book.startup import DEFAULT_PATH, TARGETS, profile_startup
+
+
+class Command(BaseCommand):
+    """ワーカーの起動時間（import 時間と最初のリクエストまでの時間）を計測する。"""
+
+    help = '新しいプロセスで wsgi / asgi を読み込み、モジュールごとの import 時間と最初のリクエストまでの時間を表示します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=TARGETS + ('all',), default='all', help='計測する入口')
+        parser.add_argument('--path', default=DEFAULT_PATH, help='最初のリクエストのパス')
+        parser.add_argument('--top', type=int, default=15, help='表示するモジュール数')
+        parser.add_argument('--sort', choices=('self', 'cumulative'), default='self', help='モジュールの並び順')
+        parser.add_argument(
+            '--budget', type=float, default=STARTUP_TIME_BUDGET,
+            help='起動＋最初のリクエストの許容秒数。超えたら終了コード 1 で終わる',
+        )
+
+    def handle(self, *args, **options):
+        targets = TARGETS if options['target'] == 'all' else (options['target'],)
+        over_budget = []
+        for target in targets:
+            try:
+                profile = profile_startup(target, options['path'])
+            except RuntimeError as exc:
+                raise CommandError(str(exc))
+            cold_start = profile['boot'] + profile['first_request']
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{target}: 起動 {profile["boot"] * 1000:.0f}ms / 最初のリクエスト '
+                f'{profile["first_request"] * 1000:.0f}ms（HTTP {profile["status"]}）/ '
+                f'プロセス全体 {profile["total"] * 1000:.0f}ms'
+            ))
+
+            imports = profile['imports']
+            column = 1 if options['sort'] == 'self' else 2
+            self.stdout.write(f'  import 時間の上位（{options["sort"]}）:')
+            for name, self_us, cumulative_us, _ in sorted(imports, key=lambda row: -row[column])[:options['top']]:
+                self.stdout.write(f'    {self_us / 1000:8.1f}ms  累計 {cumulative_us / 1000:8.1f}ms  {name}')
+
+            # 最上位のパッケージごとの合計（自身の時間の和なので重複しない）
+            packages = defaultdict(int)
+            for name, self_us, _, _ in imports:
+                packages[name.split('.')[0]] += self_us
+            self.stdout.write('  パッケージ別:')
+            for package, total_us in sorted(packages.items(), key=lambda item: -item[1])[:options['top']]:
+                self.stdout.write(f'    {total_us / 1000:8.1f}ms  {package}')
+
+            if cold_start > options['budget']:
+                over_budget.append(f'{target}（{cold_start:.2f}秒）')
+
+        if over_budget:
+            raise CommandError(f'起動時間が予算 {options["budget"]:.2f}秒 を超えました: {"、".join(over_budget)}')
+        self.stdout.write(self.style.SUCCESS(f'起動時間は予算 {options["budget"]:.2f}秒 以内です'))
@@ -0,0 +1,101 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlencode
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.urls import reverse
+
+from book import pagecache, queries
+from book.autocomplete import build_title_index
+from book.caching import shared_cache_enabled
+from book.feeds import sitemap_chunks
+from book.views import prerender_shared_page
+
+
+class Command(BaseCommand):
+    """デプロイ直後の最初のリクエストが遅くならないよう、読み取りの重いキャッシュを埋める。
+
+    build.sh から、またはワーカー起動時（WARM_CACHES_ON_BOOT=1）に実行する。
+    読み取り結果のキャッシュはワーカー間で共有されるキャッシュ（CACHE_BACKEND）があるときだけ
+    使われるので、無ければ何もしない。SHARED_PAGE_CACHE が有効なら、トップページ・カテゴリごとの
+    一覧の 1 ページ目・レビューの多い書籍の詳細ページの本文も描画しておく。
+    入力補完のインデックスはプロセスごとに持つため、作るのはワーカー起動時（--title-index）だけにする。
+    """
+
+    help = 'カテゴリ一覧・件数・ランキング・人気書籍・sitemap の分割・共有ページを事前に計算し、キャッシュを温めます。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='同時に実行する件数')
+        parser.add_argument('--pages', type=int, default=3, help='ランキングを何ページ目まで温めるか')
+        parser.add_argument(
+            '--details', type=int, default=20, help='共有ページを温めるとき、レビューの多い順に何冊の詳細ページを描画するか'
+        )
+        parser.add_argument(
+            '--title-index', action='store_true', help='このプロセスの入力補完インデックスも作る（ワーカー起動時用）'
+        )
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency には 1 以上を指定してください')
+        started = time.perf_counter()
+
+        tasks = []
+        if options['title_index']:
+            tasks.append(('title-index', lambda: len(build_title_index())))
+        if shared_cache_enabled():
+            categories = [category['value'] for category in queries.category_list()]
+            tasks.append(('categories', lambda: queries.category_list(limit=20)))
+            tasks.append(('sitemap-chunks', sitemap_chunks))
+            for category in [''] + categories:
+                tasks.append((f'count:{category}', lambda category=category: queries.count_books('', category)))
+                tasks.append((f'trending:{category}', lambda category=category: queries.trending_books(category)))
+                for page in range(1, options['pages'] + 1):
+                    tasks.append((
+                        f'ranking:{category}:{page}',
+                        lambda category=category, page=page: queries.ranking_page('', category, page),
+                    ))
+            if pagecache.shared_page_enabled():
+                tasks.extend(self.page_tasks(categories, options['details']))
+        else:
+            self.stdout.write('ワーカー間で共有するキャッシュ（CACHE_BACKEND）が無いため、読み取り結果は温めません')
+        if not tasks:
+            return
+
+        warmed = 0
+        failed = 0
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            futures = {executor.submit(self._run, task): name for name, task in tasks}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f'{futures[future]}: {exc}')
+                else:
+                    warmed += 1
+
+        elapsed = time.perf_counter() - started
+        message = f'{warmed}件のキャッシュを温めました（{elapsed:.2f}秒）'
+        if failed:
+            self.stdout.write(self.style.WARNING(f'{message}。{failed}件は失敗しました'))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
+
+    @staticmethod
+    def page_tasks(categories, details):
+        """共有ページの本文を描画するタスク。一覧はカテゴリごとの 1 ページ目、詳細はレビューの多い順。"""
+
+        list_url = reverse('book:list-book')
+        paths = [reverse('book:index'), list_url]
+        paths += [f'{list_url}?{urlencode({"cat": category})}' for category in categories]
+        paths += [reverse('book:detail-book', kwargs={'pk': pk}) for pk in queries.most_reviewed_book_ids(details)]
+        return [(f'page:{path}', lambda path=path: prerender_shared_page(path)) for path in paths]
+
+    @staticmethod
+    def _run(task):
+        try:
+            return task()
+        finally:
+            # スレッドごとに開いた DB 接続を閉じる
+            connections.close_all()
@@ -0,0 +1,125 @@
+"""book アプリのミドルウェア。"""
+
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse
+
+from . import admission
+from .slowqueries import WATCHED_VIEW_MODULES, QueryWatcher, recorder
+
+
+class SlowQueryMiddleware:
+    """book / accounts のビューで SLOW_QUERY_THRESHOLD_MS を超えたクエリを記録する。
+
+    SLOW_QUERY_THRESHOLD_MS が None なら何もしない。
+    """
+
+    def __init__(self, get_response):
+        if settings.SLOW_QUERY_THRESHOLD_MS is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        watcher = QueryWatcher(recorder, settings.SLOW_QUERY_THRESHOLD_MS)
+        request.query_watcher = watcher
+        # TemplateResponse の描画中に発行されるクエリも含めるため、応答全体を囲む
+        with ExitStack() as stack:
+            for alias in settings.DATABASES:
+                stack.enter_context(connections[alias].execute_wrapper(watcher))
+            return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # as_view() の戻り値も __module__ はクラスのモジュールになっている
+        if view_func.__module__ in WATCHED_VIEW_MODULES:
+            view = getattr(view_func, 'view_class', view_func)
+            request.query_watcher.view = f'{view_func.__module__}.{view.__qualname__}'
+
+
+class _ReleaseOnClose:
+    """streaming_content を包み、応答が閉じられたら release() を 1 回だけ呼ぶ。
+
+    StreamingHttpResponse は中身の close() を応答の close() から呼ぶので、
+    送り終えたときも途中で切断されたときも、最後まで読まれなかったときも枠が返る。
+    """
+
+    def __init__(self, content, release):
+        self._content = content
+        self._release = release
+
+    def close(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+
+class ReleasingStream(_ReleaseOnClose):
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._content)
+
+
+class AsyncReleasingStream(_ReleaseOnClose):
+    """ASGI で async generator を返すビュー用。"""
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await anext(self._content)
+
+
+class AdmissionControlMiddleware:
+    """ルートの重さの段階ごとに同時処理数を制限し、溢れたリクエストには 503 を返す（book/admission.py）。
+
+    ADMISSION_CONTROL が False なら何もしない。
+    """
+
+    def __init__(self, get_response):
+        if not settings.ADMISSION_CONTROL:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self._release(request)
+            raise
+        tier = getattr(request, 'admission_tier', None)
+        if tier is not None and response.streaming and getattr(response, 'file_to_stream', None) is None:
+            # 生成しながら送る応答は送り終えてから枠を返す。ファイルをそのまま送る応答は
+            # サーバーの sendfile に任せられるよう包まず、すぐに返す
+            request.admission_tier = None
+            stream = AsyncReleasingStream if response.is_async else ReleasingStream
+            response.streaming_content = stream(response.streaming_content, tier.release)
+        else:
+            self._release(request)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        name = admission.classify(request)
+        if name is None:
+            return None
+        tier = admission.get_tiers()[name]
+        if not tier.acquire():
+            response = HttpResponse(
+                '混み合っているため、しばらくしてから再度お試しください。',
+                content_type='text/plain; charset=utf-8',
+                status=503,
+            )
+            response['Retry-After'] = str(tier.retry_after)
+            return response
+        request.admission_tier = tier
+        return None
+
+    @staticmethod
+    def _release(request):
+        tier = getattr(request, 'admission_tier', None)
+        if tier is not None:
+            request.admission_tier = None
+            tier.release()
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.2 on 2026-10-19 09:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_histograms(apps, schema_editor):
+    # 既存レビューを 1 回の GROUP BY で集計して分布を作る
+    Review = apps.get_model('book', 'Review')
+    RatingHistogram = apps.get_model('book', 'RatingHistogram')
+    histograms = {}
+    rows = Review.objects.order_by().values_list('book_id', 'rate').annotate(n=Count('id'))
+    for book_id, rate, n in rows:
+        histogram = histograms.setdefault(book_id, RatingHistogram(book_id=book_id))
+        setattr(histogram, f'rate_{rate}', n)
+        histogram.review_count += n
+        histogram.rate_total += rate * n
+    RatingHistogram.objects.bulk_create(histograms.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0006_bookviewcount_trendingbook'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingHistogram',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_histogram', serialize=False, to='book.book')),
+                ('rate_0', models.PositiveIntegerField(default=0)),
+                ('rate_1', models.PositiveIntegerField(default=0)),
+                ('rate_2', models.PositiveIntegerField(default=0)),
+                ('rate_3', models.PositiveIntegerField(default=0)),
+                ('rate_4', models.PositiveIntegerField(default=0)),
+                ('rate_5', models.PositiveIntegerField(default=0)),
+                ('review_count', models.PositiveIntegerField(db_index=True, default=0)),
+                ('rate_total', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(populate_histograms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-19 09:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0008_book_review_timestamps'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='category',
+            field=models.CharField(choices=[('technical', '技術書'), ('novel', '小説'), ('magazine', '雑誌'), ('law', '法律'), ('comics', 'コミック'), ('business', 'ビジネス'), ('qualification', '資格'), ('other', 'その他')], db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='rate',
+            field=models.IntegerField(choices=[(0, '0'), (1, '1'), (2, '2'), (3, '3'), (4, '4'), (5, '5')], db_index=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.2 on 2026-10-19 09:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0009_index_category_rate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('book', '書籍の登録'), ('review', 'レビューの投稿')], max_length=10)),
+                ('actor_name', models.CharField(max_length=150)),
+                ('book_title', models.CharField(max_length=100)),
+                ('review_title', models.CharField(blank=True, max_length=100)),
+                ('rate', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='book.book')),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('review', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='book.review')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', '-id'], name='timeline_owner_id_idx')],
+            },
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from .consts import MAX_RATE
 
 RATE_CHOICES = [(x, str(x)) for x in range(0, MAX_RATE + 1)]
@@ -19,10 +20,15 @@ class Book(models.Model):
     thumbnail = models.ImageField(null=True, blank=True)
     category = models.CharField(
         max_length=100,
-        choices= CATEGORY
+        choices= CATEGORY,
+        db_index=True,
     )
 
     user = models.ForeignKey('auth.User', on_delete=models.CASCADE)
+    # 新着フィードの並び順と最終更新日時の取得に使うので索引を張る
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # 詳細ページの内容が最後に変わった日時。レビューの投稿・編集・削除でも更新する（sitemap の lastmod）
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.title
@@ -31,8 +37,159 @@ class Review(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     title = models.CharField(max_length=100)
     text = models.TextField()
-    rate = models.IntegerField(choices = RATE_CHOICES)
+    rate = models.IntegerField(choices = RATE_CHOICES, db_index=True)
     user = models.ForeignKey('auth.User', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return self.title
+
+class BookViewCount(models.Model):
+    """書籍の日別閲覧数。ワーカーのメモリに溜めた件数をまとめて加算する。"""
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    date = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'date'], name='unique_book_view_count_per_day'),
+        ]
+
+    def __str__(self):
+        return f'{self.book_id} {self.date}: {self.count}'
+
+
+class TrendingBook(models.Model):
+    """閲覧数に時間減衰をかけたスコアの事前計算テーブル。`refresh_trending` で更新する。"""
+
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True)
+    score = models.FloatField(db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.book_id}: {self.score:.2f}'
+
+
+class RatingHistogram(models.Model):
+    """書籍ごとの評価点の分布。Review の保存・削除に合わせて差分で更新する。
+
+    `rate_0`〜`rate_5` は RATE_CHOICES（0〜MAX_RATE）の各点数のレビュー件数。
+    件数と合計点も持っておくことで、平均点を Review を集計せずに求められる。
+    """
+
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name='rating_histogram')
+    rate_0 = models.PositiveIntegerField(default=0)
+    rate_1 = models.PositiveIntegerField(default=0)
+    rate_2 = models.PositiveIntegerField(default=0)
+    rate_3 = models.PositiveIntegerField(default=0)
+    rate_4 = models.PositiveIntegerField(default=0)
+    rate_5 = models.PositiveIntegerField(default=0)
+    review_count = models.PositiveIntegerField(default=0, db_index=True)
+    rate_total = models.PositiveIntegerField(default=0)
+
+    RATE_FIELDS = [f'rate_{rate}' for rate, _ in RATE_CHOICES]
+
+    def __str__(self):
+        return f'{self.book_id}: {self.counts}'
+
+    @property
+    def counts(self):
+        """点数の低い順に並べた件数のリスト。"""
+
+        return [getattr(self, name) for name in self.RATE_FIELDS]
+
+    @property
+    def average(self):
+        return self.rate_total / self.review_count if self.review_count else None
+
+    def distribution(self):
+        """テンプレート表示用。点数の高い順に (点数, 件数, 割合%) を返す。"""
+
+        total = self.review_count
+        return [
+            {
+                'rate': rate,
+                'count': count,
+                'percent': round(count * 100 / total) if total else 0,
+            }
+            for rate, count in reversed(list(enumerate(self.counts)))
+        ]
+
+
+class TimelineEntry(models.Model):
+    """新着アクティビティのタイムライン。投稿時に各タイムラインへ配っておく（fan-out-on-write）。
+
+    `owner` が空の行は全体のタイムライン、入っている行はその人が登録した書籍への
+    アクティビティ。表示に必要な値は書き込み時に複製しておき、読み出しで JOIN しない。
+    """
+
+    KIND_BOOK = 'book'
+    KIND_REVIEW = 'review'
+    KIND_CHOICES = ((KIND_BOOK, '書籍の登録'), (KIND_REVIEW, 'レビューの投稿'))
+
+    owner = models.ForeignKey('auth.User', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    review = models.ForeignKey(Review, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    actor_name = models.CharField(max_length=150)
+    book_title = models.CharField(max_length=100)
+    review_title = models.CharField(max_length=100, blank=True)
+    rate = models.IntegerField(null=True, blank=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', '-id'], name='timeline_owner_id_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.owner_id or "global"}: {self.get_kind_display()} {self.book_title}'
+
+
+class SlowQuery(models.Model):
+    """しきい値を超えた遅いクエリの記録。正規化した SQL の指紋ごとに 1 行にまとめる。"""
+
+    fingerprint = models.CharField(max_length=40, unique=True)
+    sql = models.TextField()  # 正規化後の SQL
+    example_sql = models.TextField()  # 最初に記録した実際の SQL と
+    example_params = models.TextField(blank=True)  # そのパラメーター
+    view = models.CharField(max_length=200)
+    template = models.CharField(max_length=200, blank=True)  # 「テンプレート名:行番号」
+    calls = models.PositiveIntegerField(default=0)
+    total_time = models.FloatField(default=0, db_index=True)  # ミリ秒
+    max_time = models.FloatField(default=0)  # ミリ秒
+    explain = models.TextField(blank=True)
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.calls}回 {self.total_time:.1f}ms {self.sql[:60]}'
+
+    @property
+    def average_time(self):
+        return self.total_time / self.calls if self.calls else 0
+
+
+class ContentChange(models.Model):
+    """残った行の updated_at には表れない変更（書籍・レビューの削除）の最終日時。
+
+    事前生成した sitemap / フィード（render_feeds）が古くなっていないかの判定に使う。
+    """
+
+    DELETED = 'deleted'
+
+    name = models.CharField(max_length=50, primary_key=True)
+    changed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.name}: {self.changed_at}'
+
+    @classmethod
+    def mark(cls, name=DELETED):
+        """`name` の変更日時を現在時刻にする。"""
+
+        now = timezone.now()
+        if not cls.objects.filter(name=name).update(changed_at=now):
+            cls.objects.get_or_create(name=name, defaults={'changed_at': now})
@@ -0,0 +1,150 @@
+"""ログインユーザー向けページの共有キャッシュ。
+
+トップ・書籍一覧・書籍詳細は、ヘッダーのアカウント欄や投稿者本人にだけ出す編集ボタンなど
+ごく一部を除けば全員に同じ内容になる。そこでユーザーごとに変わる部分を
+`{% user_fragment %}`（Jinja2 では `user_fragment()`）で目印のコメントに置き換えて
+描画し、その HTML を全ユーザー共通でキャッシュする。応答のたびに目印だけを
+リクエストしたユーザー向けの小さなテンプレートで埋める。
+
+キャッシュキーにはパスとクエリパラメーターとコンテンツのバージョン（caching.py）を含める。
+既定では無効で、settings.SHARED_PAGE_CACHE と共有キャッシュ（SHARED_CACHE）の両方が要る。
+"""
+
+import re
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template import engines
+from django.template.context_processors import csrf
+from django.utils.safestring import mark_safe
+
+from . import timeline
+from .caching import make_key, shared_cache_enabled
+from .consts import READ_CACHE_TIMEOUT
+
+# ユーザーの入力はエスケープされるので、本文中に同じ形のコメントが紛れ込むことはない
+_PLACEHOLDER = re.compile(r'<!--user-fragment:([a-z-]+)((?::\d*)*)-->')
+
+# 名前 → (テンプレート名, コンテキストを作る関数)
+_fragments = {}
+
+
+def fragment(name, template_name):
+    """ユーザーごとの部品を登録するデコレーター。
+
+    関数は (request, *args) を受け取ってテンプレートのコンテキストを返す。
+    None を返した場合は何も描画しない。
+    """
+
+    def decorator(func):
+        _fragments[name] = (template_name, func)
+        return func
+
+    return decorator
+
+
+@fragment('header-actions', 'book/fragments/header_actions.html')
+def header_actions(request):
+    return {'user': request.user, **csrf(request)}
+
+
+@fragment('header-welcome', 'book/fragments/header_welcome.html')
+def header_welcome(request):
+    if not request.user.is_authenticated:
+        return None
+    return {'user': request.user}
+
+
+@fragment('messages', 'book/fragments/messages.html')
+def flash_messages(request):
+    messages = get_messages(request)
+    if not messages:
+        return None
+    return {'messages': messages}
+
+
+@fragment('book-owner-actions', 'book/fragments/book_owner_actions.html')
+def book_owner_actions(request, book_id, owner_id):
+    if request.user.pk is None or request.user.pk != owner_id:
+        return None
+    return {'book_id': book_id, **csrf(request)}
+
+
+@fragment('review-actions', 'book/fragments/review_actions.html')
+def review_actions(request, review_id, author_id):
+    if request.user.pk is None or request.user.pk != author_id:
+        return None
+    return {'review_id': review_id}
+
+
+@fragment('my-activity', 'book/fragments/my_activity.html')
+def my_activity(request):
+    if not request.user.is_authenticated:
+        return None
+    return {'entries': timeline.read(request.user.pk)}
+
+
+def render_fragment(request, name, *args):
+    """`name` の部品を `request` のユーザー向けに描画する。"""
+
+    template_name, func = _fragments[name]
+    context = func(request, *args)
+    if context is None:
+        return ''
+    # コンテキストプロセッサーは通さず、部品に必要な値だけで描画する
+    return engines['django'].get_template(template_name).render(context)
+
+
+def placeholder(name, *args):
+    """共有ページに埋め込む目印。引数は書籍ID・ユーザーIDなどの整数に限る。"""
+
+    parts = ''.join(f':{"" if arg is None else int(arg)}' for arg in args)
+    return mark_safe(f'<!--user-fragment:{name}{parts}-->')
+
+
+def user_fragment(context, name, *args):
+    """テンプレートから呼ばれる。共有ページの描画中なら目印を、そうでなければ部品をそのまま返す。"""
+
+    if context.get('shared_page'):
+        return placeholder(name, *args)
+    return mark_safe(render_fragment(context['request'], name, *args))
+
+
+def fill_fragments(body, request):
+    """共有ページ中の目印を `request` のユーザー向けの部品に置き換える。"""
+
+    def replace(match):
+        args = [int(arg) if arg else None for arg in match.group(2).split(':')[1:]]
+        return render_fragment(request, match.group(1), *args)
+
+    return _PLACEHOLDER.sub(replace, body)
+
+
+def shared_page_enabled():
+    """settings.SHARED_PAGE_CACHE が有効で、キャッシュがワーカー間で共有されているときだけ True。
+
+    プロセスごとのキャッシュでは書き込みを処理したワーカーしかバージョンが進まず、
+    他のワーカーが古いページを返し続けるため。
+    """
+
+    return settings.SHARED_PAGE_CACHE and shared_cache_enabled()
+
+
+def shared_page_response(request, render_page):
+    """共有キャッシュからページを返す。無ければ render_page() で描画してキャッシュする。
+
+    render_page は `shared_page=True` をコンテキストに入れて描画した応答を返すこと。
+    """
+
+    key = make_key('page', request.path, sorted(request.GET.lists()))
+    body = cache.get(key)
+    if body is None:
+        response = render_page()
+        body = response.content.decode(response.charset)
+        if response.status_code != 200:
+            response.content = fill_fragments(body, request)
+            return response
+        cache.set(key, body, READ_CACHE_TIMEOUT)
+    return HttpResponse(fill_fragments(body, request))
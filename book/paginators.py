@@ -0,0 +1,51 @@
+"""件数の数え方を軽くした Paginator。管理画面の一覧で使う。"""
+
+import hashlib
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+from .consts import ADMIN_COUNT_CACHE_TIMEOUT, ADMIN_ESTIMATE_THRESHOLD
+
+
+def estimated_row_count(queryset):
+    """PostgreSQL の統計情報（pg_class.reltuples）から表全体の推定件数を返す。使えなければ None。"""
+
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [queryset.model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    # ANALYZE 前は -1 になる
+    return row[0] if row and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """毎ページの COUNT(*) を避ける Paginator。
+
+    絞り込み無しの大きな表では PostgreSQL の推定件数を使い、
+    それ以外（SQLite や絞り込み・検索時）は正確な件数を一定時間キャッシュする。
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return super().count
+
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset)
+            if estimate is not None and estimate >= ADMIN_ESTIMATE_THRESHOLD:
+                return estimate
+
+        sql, params = queryset.query.sql_with_params()
+        digest = hashlib.sha256(f'{sql}{params!r}'.encode()).hexdigest()[:32]
+        key = f'paginator-count:{queryset.model._meta.label_lower}:{digest}'
+        return cache.get_or_set(key, queryset.count, ADMIN_COUNT_CACHE_TIMEOUT)
@@ -0,0 +1,101 @@
+"""一覧・トップページで使う読み取り処理。結果はコンテンツのバージョンごとにキャッシュする。
+
+ビューと `warm_caches` コマンドの両方から呼ばれる。
+"""
+
+from django.core.paginator import Page, Paginator
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
+
+from .caching import cached
+from .consts import ITEM_PER_PAGE, TRENDING_SIZE
+from .models import Book, RatingHistogram, TrendingBook
+
+
+def search_books(q='', category=''):
+    """キーワード（タイトル／本文／カテゴリの部分一致）とカテゴリで絞り込んだ新着順の書籍。"""
+
+    books = Book.objects.order_by('-id')
+    if q:
+        books = books.filter(
+            Q(title__icontains=q) | Q(text__icontains=q) | Q(category__icontains=q)
+        )
+    if category:
+        books = books.filter(category=category)
+    return books
+
+
+def category_list(limit=None):
+    """DB に登録されているカテゴリを、テンプレートでタグ表示できる形で返す。最大 `limit` 件。"""
+
+    def build():
+        raw_categories = (
+            Book.objects.exclude(category='')
+            .values_list('category', flat=True)
+            .distinct()
+        )
+        if limit is not None:
+            raw_categories = raw_categories[:limit]
+        category_labels = dict(Book._meta.get_field('category').choices)
+        return [
+            {
+                'value': value,
+                'label': category_labels.get(value, value),
+            }
+            for value in raw_categories
+        ]
+
+    return cached('categories', build, limit)
+
+
+def count_books(q='', category=''):
+    """検索条件に合う書籍の冊数。"""
+
+    return cached('count', lambda: search_books(q, category).count(), q, category)
+
+
+def ranking_page(q='', category='', page_number=1):
+    """評価順ランキングの 1 ページ分を Page として返す。"""
+
+    def build():
+        # 平均点とレビュー数は Review を集計せず評価分布の表から計算する
+        ranking_books = (
+            search_books(q, category)
+            .filter(rating_histogram__review_count__gt=0)  # レビューが 0 件の書籍はランキングから除外
+            .select_related('rating_histogram')
+            .annotate(
+                # 平均評価 = 合計点 / 件数
+                avg_rating=Cast('rating_histogram__rate_total', FloatField()) / F('rating_histogram__review_count'),
+                review_count=F('rating_histogram__review_count'),
+            )
+            .order_by('-avg_rating', '-review_count')  # 平均評価の高い順に並べ替え
+        )
+        page = Paginator(ranking_books, ITEM_PER_PAGE).get_page(page_number)
+        return {'books': list(page.object_list), 'number': page.number, 'count': page.paginator.count}
+
+    data = cached('ranking', build, q, category, str(page_number))
+    # キャッシュにはページの中身と件数だけを持ち、Page は件数分の range から組み立て直す
+    paginator = Paginator(range(data['count']), ITEM_PER_PAGE)
+    return Page(data['books'], data['number'], paginator)
+
+
+def trending_books(category=''):
+    """閲覧数ベースの人気ランキング。refresh_trending で事前計算した表から読む。"""
+
+    def build():
+        trending = TrendingBook.objects.select_related('book').order_by('-score')
+        if category:
+            trending = trending.filter(book__category=category)
+        return [item.book for item in trending[:TRENDING_SIZE]]
+
+    return cached('trending', build, category)
+
+
+def most_reviewed_book_ids(limit):
+    """レビュー件数の多い書籍の ID。"""
+
+    return list(
+        RatingHistogram.objects.filter(review_count__gt=0)
+        .order_by('-review_count')
+        .values_list('book_id', flat=True)[:limit]
+    )
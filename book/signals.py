@@ -0,0 +1,84 @@
+"""Book / Review の保存・削除に合わせて、派生データを更新するシグナルハンドラー。"""
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import autocomplete
+from .caching import bump_content_version
+from .histograms import add_rating
+from .models import Book, ContentChange, Review
+
+
+@receiver(post_save, sender=Book)
+def update_title_index(sender, instance, **kwargs):
+    autocomplete.book_saved(instance.pk, instance.title)
+
+
+@receiver(post_delete, sender=Book)
+def remove_from_title_index(sender, instance, **kwargs):
+    autocomplete.book_deleted(instance.pk)
+
+
+@receiver(post_save, sender=Review)
+def count_review_in_title_index(sender, instance, created, **kwargs):
+    if created:
+        autocomplete.reviews_changed(instance.book_id, 1)
+
+
+@receiver(post_delete, sender=Review)
+def uncount_review_in_title_index(sender, instance, **kwargs):
+    autocomplete.reviews_changed(instance.book_id, -1)
+
+
+@receiver(pre_save, sender=Review)
+def remember_previous_rate(sender, instance, raw=False, **kwargs):
+    # 編集で点数が変わったときに元の点数を減算できるよう、保存前の値を控えておく
+    instance._previous_rating = None
+    if instance.pk and not raw:
+        instance._previous_rating = (
+            Review.objects.filter(pk=instance.pk).values_list('book_id', 'rate').first()
+        )
+
+
+@receiver(post_save, sender=Review)
+def update_rating_histogram(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rating', None)
+    current = (instance.book_id, instance.rate)
+    if previous == current:
+        return
+    if previous is not None:
+        add_rating(*previous, -1)
+    add_rating(*current, 1)
+
+
+@receiver(post_delete, sender=Review)
+def remove_from_rating_histogram(sender, instance, **kwargs):
+    add_rating(instance.book_id, instance.rate, -1)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def touch_book(sender, instance, raw=False, **kwargs):
+    # 詳細ページの内容が変わったので書籍の更新日時（sitemap の lastmod）を進める
+    if not raw:
+        Book.objects.filter(pk=instance.book_id).update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Review)
+def mark_deleted(sender, **kwargs):
+    # 削除は残った行の updated_at に表れないので、事前生成した sitemap / フィードの鮮度判定用に控える
+    ContentChange.mark()
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_read_caches(sender, raw=False, **kwargs):
+    # 一覧・ランキングなどのキャッシュキーを切り替える
+    if not raw:
+        bump_content_version()
@@ -0,0 +1,205 @@
+"""遅いクエリの記録（スロークエリログ）。
+
+`connection.execute_wrapper` で各クエリの実行時間を測り、SLOW_QUERY_THRESHOLD_MS を
+超えたものを、呼び出し元のビュー・テンプレートの行と一緒にキューへ積む。
+EXPLAIN の取得と SlowQuery テーブルへの書き込みはバックグラウンドのスレッドで行うので、
+リクエストの応答時間にはクエリ 1 本分の計測と呼び出し元の特定しか上乗せされない。
+
+セッションやユーザーのテーブルに触れるクエリは、パラメーター（セッションキーやパスワードの
+ハッシュ）を記録せず、正規化した SQL だけを残す。
+"""
+
+import hashlib
+import inspect
+import logging
+import queue
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Greatest
+
+from .models import SlowQuery
+
+logger = logging.getLogger(__name__)
+
+# 記録対象にするビューのモジュール
+WATCHED_VIEW_MODULES = ('book.views', 'accounts.views')
+# 書き込み待ちの上限件数。溢れた分は捨てる（計測のためにリクエストを待たせない）
+QUEUE_SIZE = 1000
+# 例として保存するパラメーターの最大文字数
+PARAMS_MAX_LENGTH = 1000
+# パラメーターを記録しないテーブル（前方一致。auth_user_groups なども含む）
+SENSITIVE_TABLES = ('django_session', 'auth_user')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'%s(?:\s*,\s*%s)+')
+_SPACES = re.compile(r'\s+')
+_SENSITIVE_TABLE = re.compile(r'\b(?:%s)\w*\b' % '|'.join(map(re.escape, SENSITIVE_TABLES)), re.IGNORECASE)
+
+
+def normalize_sql(sql):
+    """リテラルや IN 句の個数の違いを取り除き、同じ形のクエリが同じ文字列になるようにする。"""
+
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDER_LIST.sub('%s, ...', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+def fingerprint(normalized_sql):
+    return hashlib.sha1(normalized_sql.encode()).hexdigest()
+
+
+def is_sensitive(sql):
+    """SENSITIVE_TABLES のテーブルに触れるクエリなら True。"""
+
+    return _SENSITIVE_TABLE.search(sql) is not None
+
+
+def _template_position():
+    """実行中のテンプレートの「名前:行番号」を返す。テンプレートの外なら空文字。"""
+
+    # 自分と QueryWatcher.__call__ の分を飛ばす
+    frame = inspect.currentframe().f_back.f_back
+    while frame is not None:
+        # DTL: Node.render_annotated の self がいま描画中のノード
+        if frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            token = getattr(node, 'token', None)
+            origin = getattr(node, 'origin', None)
+            if token is not None and origin is not None:
+                return f'{origin.template_name}:{token.lineno}'
+        # Jinja2: コンパイル済みテンプレートのモジュールは __jinja_template__ を持つ
+        template = frame.f_globals.get('__jinja_template__')
+        if template is not None:
+            return f'{template.name}:{template.get_corresponding_lineno(frame.f_lineno)}'
+        frame = frame.f_back
+    return ''
+
+
+class QueryWatcher:
+    """1 リクエスト分の execute_wrapper。`view` が入っているときだけ計測する。"""
+
+    def __init__(self, recorder, threshold_ms):
+        self.recorder = recorder
+        self.threshold_ms = threshold_ms
+        self.view = None
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.view is None:
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            if duration >= self.threshold_ms:
+                self.recorder.submit({
+                    'alias': context['connection'].alias,
+                    'sql': sql,
+                    # 機密のテーブルは値をキューにも載せない（EXPLAIN も取らない）
+                    'params': None if many or is_sensitive(sql) else params,
+                    'duration': duration,
+                    'view': self.view,
+                    'template': _template_position(),
+                })
+
+
+class SlowQueryRecorder:
+    """遅いクエリをキューで受け取り、別スレッドで EXPLAIN を取って SlowQuery に集計する。"""
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, item):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            logger.warning('スロークエリの記録待ちが溢れたため 1 件破棄しました')
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='slow-query-recorder', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                self.record(item)
+            except Exception:
+                logger.warning('スロークエリの記録に失敗しました', exc_info=True)
+            finally:
+                self._queue.task_done()
+                if self._queue.empty():
+                    connections.close_all()
+
+    def join(self):
+        """キューに積まれた分を書き終えるまで待つ。"""
+
+        self._queue.join()
+
+    def record(self, item):
+        normalized = normalize_sql(item['sql'])
+        key = fingerprint(normalized)
+        duration = item['duration']
+        updates = {
+            'calls': F('calls') + 1,
+            'total_time': F('total_time') + duration,
+            'max_time': Greatest('max_time', Value(duration, output_field=FloatField())),
+        }
+        if SlowQuery.objects.filter(fingerprint=key).update(**updates):
+            return
+        params = item['params']
+        sensitive = is_sensitive(item['sql'])
+        try:
+            SlowQuery.objects.create(
+                fingerprint=key,
+                sql=normalized,
+                example_sql=normalized if sensitive else item['sql'],
+                example_params='' if params is None or sensitive else repr(params)[:PARAMS_MAX_LENGTH],
+                view=item['view'][:200],
+                template=item['template'][:200],
+                calls=1,
+                total_time=duration,
+                max_time=duration,
+                explain='' if sensitive else explain(item['alias'], item['sql'], params),
+            )
+        except IntegrityError:
+            # 別プロセスが同じ指紋の行を先に作った
+            SlowQuery.objects.filter(fingerprint=key).update(**updates)
+
+
+def explain(alias, sql, params):
+    """クエリの実行計画を文字列で返す。SELECT 以外や取得できない場合は空文字。"""
+
+    if params is None or not sql.lstrip().upper().startswith('SELECT'):
+        return ''
+    connection = connections[alias]
+    options = {}
+    if connection.vendor == 'postgresql' and settings.SLOW_QUERY_EXPLAIN_ANALYZE:
+        # ANALYZE は実際にクエリを実行するので、SELECT に限って設定で有効にしたときだけ使う
+        options = {'analyze': True, 'buffers': True}
+    try:
+        prefix = connection.ops.explain_query_prefix(**options)
+        with connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            rows = cursor.fetchall()
+    except (DatabaseError, NotImplementedError, ValueError):
+        logger.info('EXPLAIN を取得できませんでした: %s', sql, exc_info=True)
+        return ''
+    return '\n'.join(' '.join(str(value) for value in row) for row in rows)
+
+
+# ワーカーごとに 1 つだけ持つ記録係
+recorder = SlowQueryRecorder()
@@ -0,0 +1,113 @@
+"""ワーカー起動時間の計測。
+
+新しい Python プロセスで `bookproject.wsgi`（または asgi）を `-X importtime` 付きで読み込み、
+最初の 1 リクエストを処理するまでの時間と、モジュールごとの import 時間を集める。
+`startup_profile` コマンドと、起動時間の回帰テスト（book/tests.py）から使う。
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+
+TARGETS = ('wsgi', 'asgi')
+# 最初のリクエストに使うパス。DB への書き込みが起きないページにする
+DEFAULT_PATH = '/accounts/login/'
+
+# 子プロセスで実行するスクリプト。結果は JSON 1 行で標準出力に書く
+_PROBE = r'''
+import asyncio, importlib, json, os, sys, time
+
+target, path = sys.argv[1], sys.argv[2]
+started = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bookproject.settings')
+application = importlib.import_module('bookproject.' + target).application
+booted = time.perf_counter()
+
+if target == 'wsgi':
+    from wsgiref.util import setup_testing_defaults
+
+    environ = {'PATH_INFO': path}
+    setup_testing_defaults(environ)
+    statuses = []
+    body = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b''.join(body)
+    if hasattr(body, 'close'):
+        body.close()
+    status = int(statuses[0].split()[0])
+else:
+    messages = []
+    requests = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+    async def receive():
+        # 本文を渡した後は、応答が終わるまで切断を通知しない
+        if requests:
+            return requests.pop()
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'localhost')], 'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+    }
+    asyncio.run(application(scope, receive, send))
+    status = messages[0]['status']
+
+done = time.perf_counter()
+print(json.dumps({
+    'boot': booted - started,
+    'first_request': done - booted,
+    'status': status,
+    'modules': sorted(sys.modules),
+}))
+'''
+
+
+def parse_importtime(stderr):
+    """`-X importtime` の出力を (モジュール名, 自身の時間[µs], 累計[µs], 深さ) のリストにする。"""
+
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        head, cumulative_us, name = line.split('|')
+        self_us = head.split(':', 1)[1]
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+def profile_startup(target='wsgi', path=DEFAULT_PATH):
+    """新しいプロセスで起動と最初のリクエストを計測し、結果を dict で返す。
+
+    戻り値のキー: total（プロセス起動から終了まで）, boot, first_request（秒）,
+    status, modules（読み込まれたモジュール名）, imports（parse_importtime の結果）
+    """
+
+    if target not in TARGETS:
+        raise ValueError(f'target は {TARGETS} のいずれか: {target}')
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE)
+    # 計測を乱すのでキャッシュの事前読み込みは止める
+    env.pop('WARM_CACHES_ON_BOOT', None)
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _PROBE, target, path],
+        cwd=settings.BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    total = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f'{target} の起動に失敗しました:\n{result.stderr[-2000:]}')
+    profile = json.loads(result.stdout.strip().splitlines()[-1])
+    profile['total'] = total
+    profile['imports'] = parse_importtime(result.stderr)
+    return profile
@@ -0,0 +1,46 @@
+"""生成しながら送る応答（sitemap・フィード・エクスポートの zip）のヘルパー。
+
+Django 5.1 の StreamingHttpResponse は、ASGI で同期イテレーターを渡されると
+`sync_to_async(list)` で中身を全部作ってから送る。ASGI のリクエストでは、同期イテレーターを
+1 チャンクずつスレッドで進める非同期イテレーターに包んでから渡す。
+"""
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+_DONE = object()
+
+
+class SyncToAsyncStream:
+    """同期イテレーターを `sync_to_async(next)` で 1 チャンクずつ進める非同期イテレーター。
+
+    thread_sensitive=True なので、ビューと同じスレッド（同じ DB 接続）で進む。
+    close() は応答の close() から呼ばれ、元のジェネレーターを閉じる。
+    """
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        # StopIteration は Future を越えて送れないので、終わりは番兵で受け取る
+        chunk = await sync_to_async(next, thread_sensitive=True)(self._iterator, _DONE)
+        if chunk is _DONE:
+            raise StopAsyncIteration
+        return chunk
+
+    def close(self):
+        close = getattr(self._iterator, 'close', None)
+        if close is not None:
+            close()
+
+
+def streaming_response(request, chunks, **kwargs):
+    """`chunks` を少しずつ送る StreamingHttpResponse を返す。ASGI でもまとめて作らない。"""
+
+    if isinstance(request, ASGIRequest):
+        chunks = SyncToAsyncStream(chunks)
+    return StreamingHttpResponse(chunks, **kwargs)
@@ -0,0 +1,14 @@
+"""ユーザーごとに変わる部品を描画するテンプレートタグ（book/pagecache.py を参照）。"""
+
+from django import template
+
+from book import pagecache
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def user_fragment(context, name, *args):
+    """`{% user_fragment 'review-actions' review.pk review.user_id %}` のように使う。"""
+
+    return pagecache.user_fragment(context, name, *args)
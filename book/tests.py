@@ -1,3 +1,877 @@
-from django.test import TestCase
+import datetime
+import io
+import os
+import re
+import tempfile
+import threading
+from pathlib import Path
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.http import FileResponse
+from django.template import engines
+from django.template.utils import EngineHandler
+from django.test import (
+    AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, tag,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+
+from . import admission, autocomplete, pagecache, queries, timeline, viewcounts
+from .autocomplete import TitleIndex
+from .caching import bump_content_version, cached, make_key
+from .consts import ADMIN_ESTIMATE_THRESHOLD, STARTUP_TIME_BUDGET
+from .histograms import rebuild_histograms
+from .management.commands.bench_templates import Command as BenchTemplates
+from .paginators import EstimatedCountPaginator, estimated_row_count
+from .models import Book, BookViewCount, RatingHistogram, Review, SlowQuery, TimelineEntry, TrendingBook
+from .slowqueries import QueryWatcher, SlowQueryRecorder, _template_position, fingerprint, normalize_sql, recorder
+from .startup import TARGETS, profile_startup
+from .streaming import SyncToAsyncStream
+from .trending import compute_scores, refresh_trending
+from .views import JINJA2_VIEWS, template_engine_for
+
+
+class StartupTimeTests(SimpleTestCase):
+    """ワーカーの起動が遅くなっていないことを確かめる回帰テスト。
+
+    新しいプロセスで wsgi / asgi を読み込み、最初のリクエストを処理するまでを計測する。
+    実時間の計測は CI の混み具合で揺れるので、RUN_BENCHMARKS=1 のときだけ実行する。
+    """
+
+    @tag('benchmark')
+    @skipUnless(os.environ.get('RUN_BENCHMARKS') == '1', '実時間の計測は RUN_BENCHMARKS=1 のときだけ行う')
+    def test_cold_start_within_budget(self):
+        for target in TARGETS:
+            with self.subTest(target=target):
+                profile = profile_startup(target)
+                self.assertEqual(profile['status'], 200)
+                self.assertLess(profile['boot'] + profile['first_request'], STARTUP_TIME_BUDGET)
+
+    def test_heavy_modules_are_loaded_lazily(self):
+        # どれも特定のページや本番設定でしか使わないので、起動と最初のリクエストでは読み込まない
+        profile = profile_startup('wsgi')
+        self.assertEqual(profile['status'], 200)
+        for module in ('PIL', 'jinja2', 'dj_database_url', 'book.forms', 'book.feeds', 'accounts.export'):
+            with self.subTest(module=module):
+                self.assertNotIn(module, profile['modules'])
+
+
+class TitleIndexTests(SimpleTestCase):
+    """入力補完のインデックスがレビュー件数の多い順に正しい上位を返すこと。"""
+
+    def ids(self, index, query, limit=3):
+        return [result['id'] for result in index.search(query, limit)]
+
+    def test_short_query_returns_top_by_review_count(self):
+        # 1 文字の入力でも、全候補の中からレビュー件数の上位を返す
+        rows = [(book_id, f'あ{book_id}', 0) for book_id in range(1, 10001)]
+        rows += [(20001, 'ん あ', 7), (20002, 'あいう', 9)]
+        index = TitleIndex(rows)
+        self.assertEqual(self.ids(index, 'あ'), [20002, 20001, 10000])
+
+    def test_normalizes_width_case_and_kana(self):
+        index = TitleIndex([(1, 'ＰＹＴＨＯＮ入門', 0), (2, 'パイソン実践', 0)])
+        self.assertEqual(self.ids(index, 'python'), [1])
+        self.assertEqual(self.ids(index, 'ぱいそん'), [2])
+        self.assertEqual(self.ids(index, 'ﾊﾟｲｿﾝ'), [2])
+
+    def test_prefix_match_breaks_ties(self):
+        index = TitleIndex([(1, 'Python入門', 1), (2, 'はじめてのPython', 1), (3, 'Python実践', 1)])
+        self.assertEqual(self.ids(index, 'py'), [3, 1, 2])
+
+    def test_changes_after_build(self):
+        index = TitleIndex([(1, '猫の本', 5), (2, '猫と暮らす', 3), (3, '犬の本', 1)])
+        index.add_reviews(2, 4)
+        self.assertEqual(self.ids(index, '猫'), [2, 1])
+        index.remove(1)
+        index.upsert(4, '猫の写真集', 0)
+        self.assertEqual(self.ids(index, '猫'), [2, 4])
+        index.upsert(3, '猫と犬', None)
+        self.assertEqual(self.ids(index, '猫'), [2, 3, 4])
+        self.assertEqual(self.ids(index, '犬の本'), [])
+
+
+class RatingHistogramTests(TestCase):
+    """レビューの投稿・点数の変更・削除に合わせて評価分布が差分で更新されること。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader')
+        cls.book = Book.objects.create(title='評価のテスト', text='本文', category='other', user=cls.user)
+
+    def review(self, rate):
+        return Review.objects.create(book=self.book, title='感想', text='本文', rate=rate, user=self.user)
+
+    def histogram(self):
+        return RatingHistogram.objects.get(book=self.book)
+
+    def test_create_update_and_delete(self):
+        first = self.review(5)
+        self.review(3)
+        histogram = self.histogram()
+        self.assertEqual(histogram.counts, [0, 0, 0, 1, 0, 1])
+        self.assertEqual((histogram.review_count, histogram.rate_total), (2, 8))
+
+        first.rate = 1
+        first.save()
+        histogram = self.histogram()
+        self.assertEqual(histogram.counts, [0, 1, 0, 1, 0, 0])
+        self.assertEqual((histogram.review_count, histogram.rate_total), (2, 4))
+        self.assertEqual(histogram.average, 2)
+
+        # 点数を変えない保存では数え直さない
+        first.title = '書き直した感想'
+        first.save()
+        self.assertEqual(self.histogram().counts, [0, 1, 0, 1, 0, 0])
+
+        first.delete()
+        histogram = self.histogram()
+        self.assertEqual(histogram.counts, [0, 0, 0, 1, 0, 0])
+        self.assertEqual((histogram.review_count, histogram.rate_total), (1, 3))
+
+        # 差分で更新した結果が、Review を集計し直した結果と一致する
+        self.assertEqual(rebuild_histograms(dry_run=True), (0, 0))
+
+    def test_rebuild_fixes_drift(self):
+        self.review(4)
+        RatingHistogram.objects.filter(book=self.book).update(rate_4=0, review_count=0, rate_total=0)
+        self.assertEqual(rebuild_histograms(), (0, 1))
+        self.assertEqual(self.histogram().counts, [0, 0, 0, 0, 1, 0])
+
+    def test_delete_with_drifted_histogram(self):
+        review = self.review(3)
+        moved = self.review(4)
+        RatingHistogram.objects.filter(book=self.book).update(rate_3=0, rate_4=0, review_count=0, rate_total=0)
+        review.delete()
+        moved.rate = 5
+        moved.save()
+        histogram = self.histogram()
+        self.assertEqual(histogram.counts, [0, 0, 0, 0, 0, 1])
+        self.assertEqual((histogram.review_count, histogram.rate_total), (1, 5))
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.post(f'/review/{moved.pk}/delete/').status_code, 302)
+        self.assertEqual(rebuild_histograms(dry_run=True), (0, 0))
+
+    def test_book_delete_removes_histogram(self):
+        self.review(2)
+        self.book.delete()
+        self.assertFalse(RatingHistogram.objects.exists())
+
+
+class PrerenderedFeedTests(TestCase):
+    """render_feeds で書き出したファイルは、その後に書籍が変わるまでだけ配信されること。"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('writer')
+        Book.objects.create(title='最初の書籍', text='本文', category='other', user=self.user)
+        output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(output_dir.cleanup)
+        self.output_dir = Path(output_dir.name)
+        self.enterContext(override_settings(SITEMAP_ROOT=self.output_dir))
+        call_command('render_feeds', base_url='http://testserver', stdout=io.StringIO())
+
+    def age_files(self):
+        # 書き出し後に更新があったことにするため、ファイルの更新日時を過去にずらす
+        for path in self.output_dir.iterdir():
+            os.utime(path, (0, 0))
+
+    def test_fresh_files_are_served(self):
+        for url in ('/sitemap.xml', '/sitemaps/books-0.xml', '/feed.atom'):
+            with self.subTest(url=url):
+                self.assertIsInstance(self.client.get(url), FileResponse)
+
+    def test_stale_files_are_regenerated(self):
+        Book.objects.create(title='あとから登録した書籍', text='本文', category='other', user=self.user)
+        self.age_files()
+        response = self.client.get('/feed.atom')
+        self.assertNotIsInstance(response, FileResponse)
+        self.assertIn('あとから登録した書籍', b''.join(response.streaming_content).decode())
+        self.assertNotIsInstance(self.client.get('/sitemap.xml'), FileResponse)
+
+    def test_deletion_makes_files_stale(self):
+        deleted = Book.objects.create(title='削除する書籍', text='本文', category='other', user=self.user)
+        call_command('render_feeds', base_url='http://testserver', stdout=io.StringIO())
+        # 残る書籍の updated_at はファイルより古い。削除だけがファイルより新しい変更になる
+        now = timezone.now()
+        Book.objects.update(updated_at=now - datetime.timedelta(hours=1))
+        for path in self.output_dir.iterdir():
+            os.utime(path, (now.timestamp() - 60,) * 2)
+        self.assertIsInstance(self.client.get('/sitemaps/books-0.xml'), FileResponse)
+
+        deleted.delete()
+        for url in ('/sitemaps/books-0.xml', '/feed.atom'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertNotIsInstance(response, FileResponse)
+                self.assertNotIn(f'/book/{deleted.pk}/detail/', b''.join(response.streaming_content).decode())
+
+    async def test_streamed_in_chunks_under_asgi(self):
+        self.age_files()
+        await Book.objects.abulk_create(
+            Book(title=f'書籍{number}', text='本文', category='other', user=self.user) for number in range(600)
+        )
+        response = await AsyncClient().get('/sitemaps/books-0.xml')
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response]
+        self.assertGreater(len(chunks), 1)
+        self.assertIn(b'</urlset>', chunks[-1])
+
+
+class SyncToAsyncStreamTests(SimpleTestCase):
+    """同期ジェネレーターを 1 チャンクずつ進め、先読みしないこと。"""
+
+    async def test_pulls_one_chunk_at_a_time(self):
+        produced = []
+
+        def chunks():
+            for number in range(3):
+                produced.append(number)
+                yield number
+
+        stream = SyncToAsyncStream(chunks())
+        self.assertEqual(await anext(stream), 0)
+        self.assertEqual(produced, [0])
+        self.assertEqual([chunk async for chunk in stream], [1, 2])
+        stream.close()
+
+
+class ReadCacheTests(SimpleTestCase):
+    """読み取り結果のキャッシュは、ワーカー間で共有されるキャッシュがあるときだけ使われること。"""
+
+    def build(self):
+        self.calls += 1
+        return self.calls
+
+    def setUp(self):
+        self.calls = 0
+
+    @override_settings(SHARED_CACHE=False)
+    def test_not_cached_without_shared_cache(self):
+        self.assertEqual([cached('test', self.build), cached('test', self.build)], [1, 2])
+
+    @override_settings(SHARED_CACHE=True)
+    def test_cached_until_content_changes(self):
+        self.assertEqual([cached('test', self.build), cached('test', self.build)], [1, 1])
+        bump_content_version()
+        self.assertEqual(cached('test', self.build), 2)
+
+
+class ReviewAdminDeleteTests(TestCase):
+    """管理画面の一括削除でも、レビューから作った派生データがすべて更新されること。"""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin')
+        self.author = User.objects.create_user('author')
+        self.book = Book.objects.create(title='管理画面のテスト', text='本文', category='other', user=self.author)
+        self.reviews = [
+            Review.objects.create(book=self.book, title=f'感想{rate}', text='本文', rate=rate, user=self.admin)
+            for rate in (1, 4, 5)
+        ]
+        self.client.force_login(self.admin)
+
+    def test_delete_reviews_updates_derived_data(self):
+        index = TitleIndex([(self.book.pk, self.book.title, 3)])
+        updated_at = Book.objects.get(pk=self.book.pk).updated_at
+        selected = [review.pk for review in self.reviews[:2]]
+        with mock.patch.object(autocomplete, '_index', index):
+            response = self.client.post(
+                '/admin/book/review/', {'action': 'delete_reviews', '_selected_action': selected}
+            )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(Review.objects.values_list('pk', flat=True)), [self.reviews[2].pk])
+        self.assertEqual(RatingHistogram.objects.get(book=self.book).counts, [0, 0, 0, 0, 0, 1])
+        self.assertEqual(index.search('管理画面')[0]['review_count'], 1)
+        self.assertFalse(TimelineEntry.objects.filter(review_id__in=selected).exists())
+        self.assertGreater(Book.objects.get(pk=self.book.pk).updated_at, updated_at)
+
+    def delete_queries(self, count):
+        reviews = Review.objects.bulk_create(
+            Review(book=self.book, title='一括', text='本文', rate=3, user=self.admin) for _ in range(count)
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(
+                '/admin/book/review/',
+                {'action': 'delete_reviews', '_selected_action': [review.pk for review in reviews]},
+            )
+        self.assertFalse(Review.objects.filter(pk__in=[review.pk for review in reviews]).exists())
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        # 1 回目は一覧の件数のキャッシュや削除日時の行を作る分が増えるので、2 回目以降を比べる
+        self.delete_queries(1)
+        # 1 バッチに収まる件数なら、削除する行数によらずクエリ数は同じ
+        self.assertEqual(self.delete_queries(5), self.delete_queries(200))
+
+    def test_deleted_in_batches(self):
+        with mock.patch('book.admin.ADMIN_DELETE_BATCH_SIZE', 2):
+            self.client.post(
+                '/admin/book/review/',
+                {'action': 'delete_reviews', '_selected_action': [review.pk for review in self.reviews]},
+            )
+        self.assertFalse(Review.objects.exists())
+        self.assertEqual(RatingHistogram.objects.get(book=self.book).counts, [0] * 6)
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    """管理画面の件数は、大きな表では推定値を使い、それ以外は正確な件数をキャッシュすること。"""
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user('owner')
+        for number in range(3):
+            Book.objects.create(title=f'件数{number}', text='本文', category='other', user=user)
+
+    def count(self, queryset):
+        if not isinstance(queryset, list):
+            queryset = queryset.order_by('pk')
+        return EstimatedCountPaginator(queryset, 10).count
+
+    def test_exact_count_is_cached(self):
+        self.assertEqual(self.count(Book.objects.all()), 3)
+        Book.objects.filter(title='件数0').delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.count(Book.objects.all()), 3)
+        # 絞り込みが違えば別に数える
+        self.assertEqual(self.count(Book.objects.filter(title__startswith='件数')), 2)
+
+    def test_estimate_for_large_unfiltered_table(self):
+        with mock.patch('book.paginators.estimated_row_count', return_value=ADMIN_ESTIMATE_THRESHOLD) as estimate:
+            with self.assertNumQueries(0):
+                self.assertEqual(self.count(Book.objects.all()), ADMIN_ESTIMATE_THRESHOLD)
+            self.assertEqual(self.count(Book.objects.filter(category='other')), 3)
+        estimate.assert_called_once()
+
+    def test_small_estimate_uses_exact_count(self):
+        with mock.patch('book.paginators.estimated_row_count', return_value=10):
+            self.assertEqual(self.count(Book.objects.all()), 3)
+
+    def test_sqlite_has_no_estimate(self):
+        self.assertIsNone(estimated_row_count(Book.objects.all()))
+
+    def test_lists_are_counted_directly(self):
+        self.assertEqual(self.count([1, 2]), 2)
+
+
+class TimelineTests(TestCase):
+    """投稿時に全体と書籍の登録者のタイムラインへ配られ、上限件数で切り詰められること。"""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+        self.reader = User.objects.create_user('reader')
+        self.book = Book.objects.create(title='配信のテスト', text='本文', category='other', user=self.owner)
+
+    def entries(self, owner=None):
+        return [(entry.kind, entry.actor_name, entry.review_title) for entry in timeline.read(owner and owner.pk)]
+
+    def test_review_fans_out_to_global_and_book_owner(self):
+        self.client.force_login(self.reader)
+        response = self.client.post(f'/book/{self.book.pk}/review/', {'title': '面白い', 'text': '本文', 'rate': 4})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.entries(), [('review', 'reader', '面白い')])
+        self.assertEqual(self.entries(self.owner), [('review', 'reader', '面白い')])
+        self.assertEqual(self.entries(self.reader), [])
+
+    def test_own_review_goes_to_global_only(self):
+        review = Review.objects.create(book=self.book, title='自分の本', text='本文', rate=3, user=self.owner)
+        timeline.push_review(review)
+        self.assertEqual(len(timeline.read()), 1)
+        self.assertEqual(self.entries(self.owner), [])
+
+    def test_book_and_review_edits_update_copies(self):
+        review = Review.objects.create(book=self.book, title='最初', text='本文', rate=2, user=self.reader)
+        timeline.push_review(review)
+        review.title, review.rate = '書き直し', 5
+        timeline.update_review(review)
+        self.book.title = '改題'
+        timeline.update_book(self.book)
+        for entry in timeline.read() + timeline.read(self.owner.pk):
+            self.assertEqual((entry.book_title, entry.review_title, entry.rate), ('改題', '書き直し', 5))
+
+    def test_trimmed_to_size(self):
+        with mock.patch.object(timeline, 'GLOBAL_TIMELINE_SIZE', 3), mock.patch.object(timeline, 'USER_TIMELINE_SIZE', 2):
+            for number in range(5):
+                review = Review.objects.create(
+                    book=self.book, title=f'感想{number}', text='本文', rate=3, user=self.reader
+                )
+                timeline.push_review(review)
+        self.assertEqual([title for _, _, title in self.entries()], ['感想4', '感想3', '感想2'])
+        self.assertEqual([title for _, _, title in self.entries(self.owner)], ['感想4', '感想3'])
+
+    def test_rebuild_matches_fan_out(self):
+        timeline.push_book(self.book)
+        review = Review.objects.create(book=self.book, title='感想', text='本文', rate=4, user=self.reader)
+        timeline.push_review(review)
+        pushed = (self.entries(), self.entries(self.owner))
+        self.assertEqual(timeline.rebuild(), 3)
+        self.assertEqual((self.entries(), self.entries(self.owner)), pushed)
+
+
+@skipIf(settings.JINJA2_ENGINE is None, 'Jinja2 がインストールされていない')
+class TemplateEngineParityTests(TestCase):
+    """Jinja2 版のテンプレートが DTL 版と同じ HTML を描画すること。"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('benchmark')
+        self.bench = BenchTemplates()
+        self.books = self.bench.seed_books(12, self.user)
+        self.engines = {'django': engines['django'], 'jinja2': EngineHandler([settings.JINJA2_ENGINE])['jinja2']}
+
+    def render(self, engine, template_name, path, context):
+        request = RequestFactory().get(path)
+        request.user = self.user
+        request.resolver_match = resolve(path)
+        request.session = {}
+        request._messages = FallbackStorage(request)
+        html = self.engines[engine].get_template(template_name).render(dict(context), request)
+        # 空白の違いと、描画のたびに変わる CSRF トークンは比べない
+        html = re.sub(r'name="csrfmiddlewaretoken" value="\w+"', 'name="csrfmiddlewaretoken"', html)
+        return re.sub(r'>\s+<', '><', re.sub(r'\s+', ' ', html)).strip()
+
+    def test_hot_templates_render_the_same(self):
+        book = self.books[0]
+        cases = {
+            'index': ('book/index.html', '/', self.bench.index_context(self.books)),
+            'list-book': ('book/book_list.html', '/book/', self.bench.list_context(self.books)),
+            'detail-book': (
+                'book/book_detail.html', f'/book/{book.pk}/detail/', self.bench.detail_context(book, 5, self.user)
+            ),
+        }
+        self.assertEqual(sorted(cases), sorted(JINJA2_VIEWS))
+        for name, (template_name, path, context) in cases.items():
+            # 共有キャッシュ用（目印のまま）とユーザーごとの部品を埋めた描画の両方を比べる
+            for shared_page in (True, False):
+                with self.subTest(view=name, shared_page=shared_page):
+                    context = dict(context, shared_page=shared_page)
+                    self.assertEqual(
+                        self.render('jinja2', template_name, path, context),
+                        self.render('django', template_name, path, context),
+                    )
+
+    @override_settings(BOOK_TEMPLATE_ENGINES={'index': 'jinja2', 'create-book': 'jinja2'})
+    def test_jinja2_only_for_hot_views(self):
+        with override_settings(TEMPLATES=settings.TEMPLATES + [settings.JINJA2_ENGINE]):
+            self.assertEqual(template_engine_for('index'), 'jinja2')
+            self.assertIsNone(template_engine_for('create-book'))
+
+
+class SlowQueryLogTests(TestCase):
+    """遅いクエリを呼び出し元のビュー・テンプレートの行と一緒に、同じ形のクエリごとにまとめて記録すること。
+
+    セッションやユーザーのテーブルに触れるクエリは、値を残さず正規化した SQL だけを記録すること。
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('slow')
+        self.book = Book.objects.create(title='遅い本', text='本文', category='other', user=self.user)
+
+    def record(self, sql, params, duration=250.0):
+        SlowQueryRecorder().record({
+            'alias': 'default', 'sql': sql, 'params': params, 'duration': duration,
+            'view': 'book.views.index', 'template': '',
+        })
+        return SlowQuery.objects.get()
+
+    def submitted(self, path, **settings_overrides):
+        """閾値 0 ミリ秒で path を開き、記録係に渡された分を返す。"""
+
+        items = []
+        # 記録係のスレッドは通さず、渡された分をこのスレッドで受け取る
+        # （ミドルウェアはクライアントの最初のリクエストで作られるので、その前に設定を変える）
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=0, **settings_overrides), \
+                mock.patch.object(recorder, 'submit', items.append):
+            client = Client()
+            client.force_login(self.user)
+            self.assertEqual(client.get(path).status_code, 200)
+        return items
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(settings.SLOW_QUERY_THRESHOLD_MS)
+
+    def test_request_is_recorded(self):
+        items = self.submitted('/book/')
+        self.assertTrue(items)
+        self.assertEqual({item['view'] for item in items}, {'book.views.ListBookView'})
+        self.assertTrue(any(re.fullmatch(r'book/book_list\.html:\d+', item['template']) for item in items))
+
+        for item in items:
+            recorder.record(item)
+        sql = next(item['sql'] for item in items if '"book_book"' in item['sql'])
+        entry = SlowQuery.objects.get(fingerprint=fingerprint(normalize_sql(sql)))
+        self.assertEqual(entry.view, 'book.views.ListBookView')
+
+    def test_jinja2_template_position(self):
+        items = self.submitted(
+            '/book/',
+            TEMPLATES=settings.TEMPLATES + [settings.JINJA2_ENGINE],
+            BOOK_TEMPLATE_ENGINES={'list-book': 'jinja2'},
+        )
+        self.assertTrue(any(re.fullmatch(r'book/book_list\.html:\d+', item['template']) for item in items))
+
+    def test_only_watched_views(self):
+        # 管理画面（django.contrib.admin のビュー）のクエリは記録しない
+        User.objects.filter(pk=self.user.pk).update(is_staff=True, is_superuser=True)
+        self.assertEqual(self.submitted('/admin/book/book/'), [])
+
+    def test_template_position_outside_templates(self):
+        self.assertEqual(_template_position(), '')
+
+    def test_threshold(self):
+        items = []
+        watcher = QueryWatcher(mock.Mock(submit=items.append), threshold_ms=60_000)
+        watcher.view = 'book.views.index'
+        with connection.execute_wrapper(watcher):
+            list(Book.objects.all())
+            watcher.threshold_ms = 0
+            list(Book.objects.all())
+        self.assertEqual(len(items), 1)
+
+    def test_same_shape_is_one_entry(self):
+        self.record('SELECT "book_book"."id" FROM "book_book" WHERE "book_book"."id" IN (%s, %s)', (1, 2))
+        entry = self.record('SELECT "book_book"."id" FROM "book_book" WHERE "book_book"."id" IN (%s, %s, %s)', (1, 2, 3), 400.0)
+        self.assertEqual((entry.calls, entry.total_time, entry.max_time), (2, 650.0, 400.0))
+        self.assertEqual(entry.sql, 'SELECT "book_book"."id" FROM "book_book" WHERE "book_book"."id" IN (%s, ...)')
+
+    def test_command(self):
+        self.record('SELECT "book_book"."id" FROM "book_book" WHERE "book_book"."id" = %s', (1,))
+        out = io.StringIO()
+        call_command('slow_queries', explain=True, reset=True, stdout=out)
+        output = out.getvalue()
+        self.assertIn('#1 合計 250.0ms / 1回', output)
+        self.assertIn('呼び出し元: book.views.index', output)
+        self.assertIn('実行計画:', output)
+        self.assertIn('1件の記録を消去しました', output)
+        self.assertFalse(SlowQuery.objects.exists())
+
+        out = io.StringIO()
+        call_command('slow_queries', stdout=out)
+        self.assertIn('記録された遅いクエリはありません', out.getvalue())
+
+    def test_sensitive_tables_are_redacted(self):
+        sql = 'SELECT "django_session"."session_data" FROM "django_session" WHERE "django_session"."session_key" = %s'
+        entry = self.record(sql, ('secret-session-key',))
+        self.assertEqual((entry.example_sql, entry.example_params, entry.explain), (entry.sql, '', ''))
+
+        SlowQuery.objects.all().delete()
+        entry = self.record('UPDATE "auth_user" SET "password" = %s WHERE "auth_user"."id" = %s', ('pbkdf2_sha256$x', 1))
+        self.assertNotIn('pbkdf2', entry.example_params + entry.example_sql)
+
+    def test_other_tables_keep_example(self):
+        sql = 'SELECT "book_book"."id" FROM "book_book" WHERE "book_book"."title" LIKE %s'
+        entry = self.record(sql, ('%Django%',))
+        self.assertEqual((entry.example_sql, entry.example_params), (sql, "('%Django%',)"))
+        self.assertNotEqual(entry.explain, '')
+
+
+@override_settings(SHARED_PAGE_CACHE=True, SHARED_CACHE=True)
+class SharedPageCacheTests(TestCase):
+    """共有キャッシュしたページでも、ヘッダー・編集ボタン・CSRF トークンはユーザーごとに描画されること。"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.reader = User.objects.create_user('reader')
+        self.book = Book.objects.create(title='共有キャッシュ', text='本文', category='other', user=self.owner)
+
+    def client_for(self, user):
+        client = Client(enforce_csrf_checks=True)
+        if user is not None:
+            client.force_login(user)
+        return client
+
+    def csrf_token(self, response):
+        return re.search(r'name="csrfmiddlewaretoken" value="(\w+)"', response.content.decode()).group(1)
+
+    def serve_from_cache(self, path, users):
+        # 1 回目で本文をキャッシュに載せ、シグナルを通さずに書き換えて 2 回目以降がキャッシュだと分かるようにする
+        responses = [self.client_for(users[0]).get(path)]
+        Book.objects.filter(pk=self.book.pk).update(title='書き換え後')
+        responses += [self.client_for(user).get(path) for user in users[1:]]
+        for response in responses:
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, '共有キャッシュ')
+        return responses
+
+    def test_detail_page_per_user(self):
+        reader, owner = self.serve_from_cache(f'/book/{self.book.pk}/detail/', [self.reader, self.owner])
+        self.assertContains(reader, 'こんにちは、<a href="/accounts/profile/">reader</a> さん')
+        self.assertNotContains(reader, '書籍を削除')
+        self.assertContains(owner, 'こんにちは、<a href="/accounts/profile/">owner</a> さん')
+        self.assertContains(owner, '書籍を削除')
+        self.assertNotContains(owner, '<!--user-fragment:')
+
+    def test_index_for_anonymous_and_users(self):
+        anonymous, owner, reader = self.serve_from_cache('/', [None, self.owner, self.reader])
+        self.assertContains(anonymous, 'ログイン</a>')
+        self.assertNotContains(anonymous, 'ログアウト')
+        self.assertNotContains(anonymous, 'こんにちは')
+        self.assertContains(owner, 'owner</a> さん')
+        self.assertContains(reader, 'reader</a> さん')
+        self.assertNotContains(reader, 'owner</a> さん')
+
+    def test_csrf_token_belongs_to_each_user(self):
+        path = f'/book/{self.book.pk}/detail/'
+        clients = {user.username: self.client_for(user) for user in (self.owner, self.reader)}
+        tokens = {name: self.csrf_token(client.get(path)) for name, client in clients.items()}
+        # 他人のページに入っていたトークンでは通らない
+        self.assertEqual(clients['reader'].post('/accounts/logout/', {'csrfmiddlewaretoken': tokens['owner']}).status_code, 403)
+        self.assertEqual(clients['reader'].post('/accounts/logout/', {'csrfmiddlewaretoken': tokens['reader']}).status_code, 302)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_disabled_without_shared_cache(self):
+        self.assertFalse(pagecache.shared_page_enabled())
+
+
+class WarmCachesTests(TransactionTestCase):
+    """warm_caches が読み取り結果と共有ページをキャッシュに載せること。
+
+    タスクは別スレッドで DB を読むので、データをコミットする TransactionTestCase で確かめる。
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('warmer')
+        self.reviewed = Book.objects.create(title='よく読まれる本', text='本文', category='technical', user=self.user)
+        self.quiet = Book.objects.create(title='静かな本', text='本文', category='other', user=self.user)
+        Review.objects.create(book=self.reviewed, title='良い', text='本文', rate=5, user=self.user)
+
+    def warm(self, **options):
+        out = io.StringIO()
+        call_command('warm_caches', pages=1, stdout=out, **options)
+        return out.getvalue()
+
+    def warmed_count(self, output):
+        return int(re.search(r'(\d+)件のキャッシュを温めました', output).group(1))
+
+    @override_settings(SHARED_CACHE=True)
+    def test_read_caches(self):
+        output = self.warm()
+        # カテゴリ一覧・sitemap の分割 + （全体と 2 カテゴリ）×（件数・人気書籍・ランキング 1 ページ）
+        self.assertEqual(self.warmed_count(output), 2 + 3 * 3)
+        with self.assertNumQueries(0):
+            queries.category_list(limit=20)
+            queries.count_books('', 'technical')
+            queries.trending_books('other')
+            queries.ranking_page('', 'technical', 1)
+        self.assertIsNone(cache.get(make_key('page', '/book/', [])))
+
+    @override_settings(SHARED_CACHE=True, SHARED_PAGE_CACHE=True)
+    def test_shared_pages(self):
+        with mock.patch.object(viewcounts.view_counter, 'record') as record:
+            output = self.warm(details=1)
+        record.assert_not_called()
+        # 読み取り結果 11 件 + トップ・一覧・カテゴリごとの一覧 2 件・レビューの多い詳細 1 件
+        self.assertEqual(self.warmed_count(output), 11 + 5)
+        for path, params in [
+            ('/', []),
+            ('/book/', []),
+            ('/book/', [('cat', ['technical'])]),
+            ('/book/', [('cat', ['other'])]),
+            (f'/book/{self.reviewed.pk}/detail/', []),
+        ]:
+            self.assertIsNotNone(cache.get(make_key('page', path, params)), (path, params))
+        self.assertIsNone(cache.get(make_key('page', f'/book/{self.quiet.pk}/detail/', [])))
+
+        # 温めた本文がそのまま使われ、ユーザーごとの部分は埋められる
+        Book.objects.filter(pk=self.reviewed.pk).update(title='書き換え後')
+        client = Client()
+        client.force_login(self.user)
+        response = client.get(f'/book/{self.reviewed.pk}/detail/')
+        self.assertContains(response, 'よく読まれる本')
+        self.assertContains(response, 'warmer</a> さん')
+        self.assertContains(response, '書籍を削除')
+
+    @override_settings(SHARED_CACHE=False, SHARED_PAGE_CACHE=True)
+    def test_skips_without_shared_cache(self):
+        output = self.warm()
+        self.assertIn('読み取り結果は温めません', output)
+        self.assertNotIn('件のキャッシュを温めました', output)
+        with self.assertNumQueries(1):
+            queries.category_list(limit=20)
+
+
+class AdmissionControlTests(TestCase):
+    """段階ごとの同時処理数の上限・待ち行列・503 と Retry-After・監視用 JSON の権限。"""
+
+    def setUp(self):
+        admission.reset_tiers()
+        self.addCleanup(admission.reset_tiers)
+
+    def classify(self, path):
+        request = RequestFactory().get(path)
+        request.resolver_match = resolve(request.path)
+        return admission.classify(request)
+
+    def test_classify(self):
+        self.assertEqual(self.classify('/book/1/detail/'), 'cheap')
+        # 明示した段階が検索語より優先される（入力補完は q 付きでも軽い）
+        self.assertEqual(self.classify('/book/autocomplete/?q=django'), 'cheap')
+        self.assertEqual(self.classify('/'), 'standard')
+        self.assertEqual(self.classify('/?q=django'), 'expensive')
+        self.assertEqual(self.classify('/book/?q=django'), 'expensive')
+        # 一覧に無いルートは既定の段階、検索語付きなら重い段階
+        self.assertEqual(self.classify('/review/1/edit/'), admission.DEFAULT_TIER)
+        self.assertEqual(self.classify('/review/1/edit/?q=django'), admission.SEARCH_TIER)
+        self.assertIsNone(self.classify('/admin/'))
+
+    def test_tier_limit(self):
+        tier = admission.Tier('test', concurrency=2, queue=0, timeout=1.0, retry_after=1)
+        self.assertTrue(tier.acquire())
+        self.assertTrue(tier.acquire())
+        self.assertFalse(tier.acquire())
+        tier.release()
+        self.assertTrue(tier.acquire())
+        self.assertEqual(
+            {key: tier.stats()[key] for key in ('in_flight', 'admitted', 'rejected', 'timed_out')},
+            {'in_flight': 2, 'admitted': 3, 'rejected': 1, 'timed_out': 0},
+        )
+
+    def test_queue_timeout(self):
+        tier = admission.Tier('test', concurrency=1, queue=1, timeout=0.05, retry_after=1)
+        self.assertTrue(tier.acquire())
+        self.assertFalse(tier.acquire())
+        self.assertEqual((tier.stats()['timed_out'], tier.stats()['waiting']), (1, 0))
+
+    def test_queued_request_is_admitted_on_release(self):
+        tier = admission.Tier('test', concurrency=1, queue=1, timeout=5.0, retry_after=1)
+        self.assertTrue(tier.acquire())
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(tier.acquire()))
+        waiter.start()
+        while not tier.stats()['waiting']:
+            waiter.join(0.001)
+        tier.release()
+        waiter.join()
+        self.assertEqual(results, [True])
+        self.assertEqual(tier.stats()['queued'], 1)
+
+    def test_rejected_with_retry_after(self):
+        tiers = {
+            'cheap': {'concurrency': 0, 'queue': 0, 'timeout': 0.0, 'retry_after': 7},
+            'standard': {'concurrency': 4, 'queue': 0, 'timeout': 0.0, 'retry_after': 1},
+            'expensive': {'concurrency': 4, 'queue': 0, 'timeout': 0.0, 'retry_after': 1},
+        }
+        with override_settings(ADMISSION_TIERS=tiers):
+            admission.reset_tiers()
+            response = self.client.get('/feed.atom')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '7')
+            # 他の段階のルートは影響を受けない
+            self.assertEqual(self.client.get('/').status_code, 200)
+            self.assertEqual(admission.stats()['cheap']['rejected'], 1)
+
+    def test_streaming_response_holds_slot_until_closed(self):
+        self.client.force_login(User.objects.create_user('reader'))
+        response = self.client.get('/accounts/export/')
+        expensive = admission.get_tiers()['expensive']
+        self.assertEqual(expensive.stats()['in_flight'], 1)
+        b''.join(response.streaming_content)
+        self.assertEqual(expensive.stats()['in_flight'], 0)
+
+    def test_stats_for_staff_only(self):
+        self.assertEqual(self.client.get('/admission/stats/').status_code, 302)
+        self.client.force_login(User.objects.create_user('reader'))
+        self.assertEqual(self.client.get('/admission/stats/').status_code, 302)
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        response = self.client.get('/admission/stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.json()['tiers']), sorted(settings.ADMISSION_TIERS))
+
+
+class ViewCountTests(TestCase):
+    """閲覧数をメモリに溜め、日別テーブルへまとめて加算すること。"""
+
+    def setUp(self):
+        owner = User.objects.create_user('owner')
+        self.book = Book.objects.create(title='閲覧数', text='本文', category='other', user=owner)
+        # 件数でも時間でも自動では書き出さない
+        self.buffer = viewcounts.ViewCountBuffer(flush_interval=3600, flush_size=1000)
+        self.addCleanup(self.buffer.flush)
+
+    def counts(self):
+        return list(BookViewCount.objects.values_list('book_id', 'count'))
+
+    def test_flush_adds_to_existing_row(self):
+        for _ in range(2):
+            self.buffer.record(self.book.pk)
+        self.assertEqual(self.buffer.pending(), 2)
+        self.assertEqual(self.counts(), [])
+        self.assertEqual(self.buffer.flush(), 1)
+        self.buffer.record(self.book.pk)
+        self.buffer.flush()
+        self.assertEqual(self.counts(), [(self.book.pk, 3)])
+        self.assertEqual(self.buffer.pending(), 0)
+
+    def test_flush_size(self):
+        buffer = viewcounts.ViewCountBuffer(flush_interval=3600, flush_size=1)
+        buffer.record(self.book.pk)
+        self.assertEqual(self.counts(), [(self.book.pk, 1)])
+
+    def test_deleted_books_are_skipped(self):
+        self.buffer.record(self.book.pk)
+        self.buffer.record(self.book.pk + 100)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.counts(), [(self.book.pk, 1)])
+
+    def test_requeued_after_database_error(self):
+        self.buffer.record(self.book.pk)
+        with self.assertLogs(viewcounts.logger, 'WARNING'), \
+                mock.patch.object(viewcounts, '_upsert_counts', side_effect=DatabaseError('locked')):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.buffer.pending(), 1)
+        self.buffer.flush()
+        self.assertEqual(self.counts(), [(self.book.pk, 1)])
+
+    def test_idle_worker_flushes_on_timer(self):
+        flushed = threading.Event()
+        buffer = viewcounts.ViewCountBuffer(flush_interval=0.01, flush_size=1000)
+        with mock.patch.object(viewcounts, '_upsert_counts', side_effect=lambda pending: flushed.set() or 1) as upsert:
+            buffer.record(self.book.pk)
+            self.assertTrue(flushed.wait(5))
+        self.assertEqual(dict(upsert.call_args.args[0]), {(self.book.pk, timezone.localdate()): 1})
+        self.assertEqual(buffer.pending(), 0)
+
+    def test_detail_view_records_view(self):
+        self.client.force_login(User.objects.create_user('reader'))
+        with mock.patch('book.views.view_counter', self.buffer):
+            self.client.get(f'/book/{self.book.pk}/detail/')
+            self.client.get(f'/book/{self.book.pk + 100}/detail/')
+        self.assertEqual(self.buffer.pending(), 1)
+
+
+class TrendingTests(TestCase):
+    """閲覧数に半減期の減衰をかけたスコアで人気ランキングを作ること。"""
+
+    def setUp(self):
+        owner = User.objects.create_user('owner')
+        self.books = [
+            Book.objects.create(title=f'人気{number}', text='本文', category='other', user=owner) for number in range(3)
+        ]
+        self.today = datetime.date(2024, 5, 20)
+
+    def views(self, book, days_ago, count):
+        BookViewCount.objects.create(book=book, date=self.today - datetime.timedelta(days=days_ago), count=count)
+
+    def test_compute_scores_decay(self):
+        self.views(self.books[0], 0, 4)
+        self.views(self.books[0], 3, 4)
+        self.views(self.books[1], 6, 8)
+        # 集計期間より前の閲覧は数えない
+        self.views(self.books[2], 14, 100)
+        scores = compute_scores(self.today, window_days=14, half_life_days=3)
+        self.assertEqual(set(scores), {self.books[0].pk, self.books[1].pk})
+        self.assertAlmostEqual(scores[self.books[0].pk], 4 + 2)
+        self.assertAlmostEqual(scores[self.books[1].pk], 2)
+
+    def test_refresh_replaces_table(self):
+        TrendingBook.objects.create(book=self.books[2], score=99)
+        self.views(self.books[0], 0, 1)
+        self.views(self.books[1], 0, 5)
+        self.assertEqual(refresh_trending(self.today, limit=1), 1)
+        self.assertEqual(list(TrendingBook.objects.values_list('book_id', flat=True)), [self.books[1].pk])
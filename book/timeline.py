@@ -0,0 +1,126 @@
+"""新着アクティビティのタイムライン。
+
+書籍・レビューの投稿時に、全体のタイムラインと関係するユーザーのタイムラインへ
+行を書き込んでおく（fan-out-on-write）。読み出しは (owner, id) の索引を
+新しい順に 1 ページ分読むだけで、Review と Book の JOIN や絞り込みは発生しない。
+各タイムラインは上限件数を超えた古い行を書き込みのたびに削除する。
+"""
+
+import heapq
+
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .consts import GLOBAL_TIMELINE_SIZE, TIMELINE_PAGE_SIZE, USER_TIMELINE_SIZE
+from .models import Book, Review, TimelineEntry
+
+
+def _book_entry(book, owner_id=None):
+    return TimelineEntry(
+        owner_id=owner_id,
+        kind=TimelineEntry.KIND_BOOK,
+        book_id=book.pk,
+        actor_name=book.user.username,
+        book_title=book.title,
+        created_at=book.created_at,
+    )
+
+
+def _review_entry(review, owner_id=None):
+    return TimelineEntry(
+        owner_id=owner_id,
+        kind=TimelineEntry.KIND_REVIEW,
+        book_id=review.book_id,
+        review_id=review.pk,
+        actor_name=review.user.username,
+        book_title=review.book.title,
+        review_title=review.title,
+        rate=review.rate,
+        created_at=review.created_at,
+    )
+
+
+def _timeline(owner_id):
+    if owner_id is None:
+        return TimelineEntry.objects.filter(owner__isnull=True)
+    return TimelineEntry.objects.filter(owner_id=owner_id)
+
+
+def trim(owner_id, size):
+    """タイムラインを新しい順に `size` 件だけ残し、それより古い行を削除する。"""
+
+    boundary = list(_timeline(owner_id).order_by('-id').values_list('id', flat=True)[size:size + 1])
+    if boundary:
+        _timeline(owner_id).filter(id__lte=boundary[0]).delete()
+
+
+def push_book(book):
+    """書籍の登録を全体のタイムラインに載せる。"""
+
+    with transaction.atomic():
+        _book_entry(book).save()
+        trim(None, GLOBAL_TIMELINE_SIZE)
+
+
+def push_review(review):
+    """レビューの投稿を全体と、書籍を登録したユーザーのタイムラインに載せる。"""
+
+    entries = [_review_entry(review)]
+    owner_id = review.book.user_id
+    # 自分の書籍に自分でレビューした場合は本人のタイムラインには載せない
+    if owner_id != review.user_id:
+        entries.append(_review_entry(review, owner_id))
+    with transaction.atomic():
+        TimelineEntry.objects.bulk_create(entries)
+        trim(None, GLOBAL_TIMELINE_SIZE)
+        if len(entries) > 1:
+            trim(owner_id, USER_TIMELINE_SIZE)
+
+
+def update_book(book):
+    """書籍タイトルの変更をタイムラインの複製にも反映する。"""
+
+    TimelineEntry.objects.filter(book_id=book.pk).update(book_title=book.title)
+
+
+def update_review(review):
+    """レビューのタイトル・点数の変更をタイムラインの複製にも反映する。"""
+
+    TimelineEntry.objects.filter(review_id=review.pk).update(review_title=review.title, rate=review.rate)
+
+
+def read(owner_id=None, limit=TIMELINE_PAGE_SIZE):
+    """タイムラインを新しい順に `limit` 件返す。`owner_id` が None なら全体。"""
+
+    return list(_timeline(owner_id).order_by('-id')[:limit])
+
+
+def rebuild():
+    """Book / Review から全タイムラインを作り直し、書き込んだ件数を返す。"""
+
+    books = Book.objects.select_related('user').order_by('-id')[:GLOBAL_TIMELINE_SIZE]
+    reviews = Review.objects.select_related('user', 'book').order_by('-id')[:GLOBAL_TIMELINE_SIZE]
+    latest = heapq.merge(
+        (_book_entry(book) for book in books),
+        (_review_entry(review) for review in reviews),
+        key=lambda entry: entry.created_at,
+        reverse=True,
+    )
+    entries = list(latest)[:GLOBAL_TIMELINE_SIZE]
+
+    # 他人の書籍へのレビューを、書籍の登録者ごとに新しい順で USER_TIMELINE_SIZE 件ずつ取る
+    owner_reviews = (
+        Review.objects.exclude(user_id=F('book__user_id'))
+        .select_related('user', 'book')
+        .annotate(position=Window(RowNumber(), partition_by=F('book__user_id'), order_by=F('id').desc()))
+        .filter(position__lte=USER_TIMELINE_SIZE)
+    )
+    entries.extend(_review_entry(review, review.book.user_id) for review in owner_reviews)
+
+    # id の順が時系列になるよう、古いものから書き込む
+    entries.sort(key=lambda entry: entry.created_at)
+    with transaction.atomic():
+        TimelineEntry.objects.all().delete()
+        TimelineEntry.objects.bulk_create(entries, batch_size=500)
+    return len(entries)
@@ -0,0 +1,45 @@
+"""閲覧数から人気ランキング（時間減衰スコア）を計算する。"""
+
+import datetime
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from .caching import bump_content_version
+from .consts import TRENDING_HALF_LIFE_DAYS, TRENDING_WINDOW_DAYS
+from .models import BookViewCount, TrendingBook
+
+# 事前計算テーブルに保存する上限件数。カテゴリ絞り込み時にも表示が残るよう多めに持つ
+TRENDING_STORE_SIZE = 200
+
+
+def compute_scores(today=None, window_days=TRENDING_WINDOW_DAYS, half_life_days=TRENDING_HALF_LIFE_DAYS):
+    """直近 `window_days` 日の閲覧数に半減期 `half_life_days` 日の減衰をかけて合計する。"""
+
+    today = today or timezone.localdate()
+    since = today - datetime.timedelta(days=window_days - 1)
+    scores = defaultdict(float)
+    rows = (
+        BookViewCount.objects.filter(date__gte=since, date__lte=today)
+        .values_list('book_id', 'date', 'count')
+        .iterator()
+    )
+    for book_id, day, count in rows:
+        age = (today - day).days
+        scores[book_id] += count * 0.5 ** (age / half_life_days)
+    return scores
+
+
+def refresh_trending(today=None, limit=TRENDING_STORE_SIZE):
+    """スコア上位 `limit` 件で TrendingBook テーブルを置き換え、保存件数を返す。"""
+
+    scores = compute_scores(today)
+    top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+    with transaction.atomic():
+        TrendingBook.objects.all().delete()
+        TrendingBook.objects.bulk_create(
+            TrendingBook(book_id=book_id, score=score) for book_id, score in top
+        )
+    bump_content_version()
+    return len(top)
@@ -10,6 +10,8 @@ urlpatterns = [
     path('', views.index_view, name='index'),
     # 書籍一覧ページ。Class-Based View は `as_view()` を通して登録する
     path('book/', views.ListBookView.as_view(), name='list-book'),
+    # 検索ボックスの入力補完（JSON）。タイトルの部分一致候補を返す
+    path('book/autocomplete/', views.autocomplete_view, name='autocomplete'),
     # 書籍詳細ページ。URL 中の `<int:pk>` は対象書籍のIDを指す
     path('book/<int:pk>/detail/', views.DetailBookView.as_view(), name='detail-book'),
     # 書籍の新規登録フォーム
@@ -24,4 +26,10 @@ urlpatterns = [
     path('review/<int:pk>/edit/', views.ReviewUpdateView.as_view(), name='review-edit'),
     # レビュー削除確認ページ
     path('review/<int:pk>/delete/', views.ReviewDeleteView.as_view(), name='review-delete'),
+    # 流入制御（段階ごとの処理中・待ち行列・拒否の件数）の監視用 JSON。スタッフのみ
+    path('admission/stats/', views.admission_stats_view, name='admission-stats'),
+    # クローラー向けの sitemap（書籍ID の範囲ごとに分割）と新着の Atom フィード
+    path('sitemap.xml', views.sitemap_index_view, name='sitemap'),
+    path('sitemaps/books-<int:chunk>.xml', views.sitemap_books_view, name='sitemap-books'),
+    path('feed.atom', views.feed_view, name='feed'),
 ]
@@ -0,0 +1,128 @@
+"""書籍の閲覧数カウンター。
+
+詳細ページを開くたびに UPDATE を発行すると SQLite では書き込みが詰まるため、
+ワーカープロセスのメモリ上で (書籍ID, 日付) ごとに件数を数えておき、
+一定時間または一定件数ごとに日別テーブルへまとめて加算（UPSERT）する。
+閲覧が途絶えたワーカーでも残りが溜まったままにならないよう、未書き出しの件数があるあいだは
+タイマーのスレッドが flush_interval 秒後に書き出す。
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.db import DatabaseError, IntegrityError, connection, connections, transaction
+from django.utils import timezone
+
+from .consts import VIEW_COUNT_FLUSH_INTERVAL, VIEW_COUNT_FLUSH_SIZE
+from .models import Book, BookViewCount
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCountBuffer:
+    """閲覧数をプロセス内に溜め、しきい値を超えたら DB へ書き出すバッファ。"""
+
+    def __init__(self, flush_interval=VIEW_COUNT_FLUSH_INTERVAL, flush_size=VIEW_COUNT_FLUSH_SIZE):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._last_flush = time.monotonic()
+        self._timer = None
+
+    def record(self, book_id):
+        """1 回分の閲覧を記録する。書き出しのタイミングが来ていればそのまま flush する。"""
+
+        key = (book_id, timezone.localdate())
+        with self._lock:
+            self._counts[key] += 1
+            due = (
+                len(self._counts) >= self.flush_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+            if not due:
+                self._schedule()
+        if due:
+            self.flush()
+
+    def _schedule(self):
+        """次の閲覧が来なくても書き出されるよう、タイマーを仕掛ける。self._lock を持って呼ぶ。"""
+
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self._flush_on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        finally:
+            # タイマーのスレッドで開いた DB 接続を閉じる
+            connections.close_all()
+
+    def pending(self):
+        """まだ DB に書き出していない件数の合計を返す。"""
+
+        with self._lock:
+            return sum(self._counts.values())
+
+    def flush(self):
+        """溜まった件数を日別テーブルへ加算し、書き出した行数を返す。"""
+
+        with self._lock:
+            pending, self._counts = self._counts, Counter()
+            self._last_flush = time.monotonic()
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        if not pending:
+            return 0
+
+        try:
+            return _upsert_counts(pending)
+        except IntegrityError:
+            # 集計中に書籍が削除された等。件数は失われるが閲覧数なので許容する
+            logger.warning('閲覧数の書き出しに失敗したため破棄しました', exc_info=True)
+        except DatabaseError:
+            # ロック待ちなど一時的な失敗は次回の flush で再試行する
+            logger.warning('閲覧数の書き出しに失敗したため次回に持ち越します', exc_info=True)
+            with self._lock:
+                self._counts.update(pending)
+                self._schedule()
+        return 0
+
+
+def _upsert_counts(pending):
+    """(書籍ID, 日付) → 件数 を 1 回の executemany で UPSERT する。"""
+
+    # 既に削除された書籍の分は外部キー違反になるので先に除外しておく
+    book_ids = {book_id for book_id, _ in pending}
+    existing = set(Book.objects.filter(pk__in=book_ids).values_list('pk', flat=True))
+    rows = [
+        (book_id, connection.ops.adapt_datefield_value(day), count)
+        for (book_id, day), count in pending.items()
+        if book_id in existing
+    ]
+    if not rows:
+        return 0
+
+    qn = connection.ops.quote_name
+    table = qn(BookViewCount._meta.db_table)
+    # SQLite(3.24+) と PostgreSQL の両方で使える ON CONFLICT 構文で既存行に加算する
+    sql = (
+        f'INSERT INTO {table} ({qn("book_id")}, {qn("date")}, {qn("count")}) '
+        f'VALUES (%s, %s, %s) '
+        f'ON CONFLICT ({qn("book_id")}, {qn("date")}) '
+        f'DO UPDATE SET {qn("count")} = {table}.{qn("count")} + EXCLUDED.{qn("count")}'
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+    return len(rows)
+
+
+# ワーカーごとに 1 つだけ持つバッファ。プロセス終了時に残りを書き出す
+view_counter = ViewCountBuffer()
+atexit.register(view_counter.flush)
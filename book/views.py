@@ -1,66 +1,115 @@
 """book アプリのビュー層。書籍・レビューに関する画面処理をまとめている。"""
 
+import os  # 監視用 JSON にワーカーのプロセスIDを含める
+from urllib.parse import urlsplit  # 事前描画するページの URL をパスとクエリに分ける
+
 from django.shortcuts import render, redirect  # HTML の描画や別ページへの遷移に使用
-from django.urls import reverse, reverse_lazy  # URL 名から実際のパスを逆引きするユーティリティ
+from django.urls import resolve, reverse, reverse_lazy  # URL 名とパスを相互に変換するユーティリティ
 from django.views.generic import ListView, DetailView, CreateView, DeleteView, UpdateView  # 汎用的なCBV
+from django.contrib.auth.decorators import login_required  # 関数ビュー用のログイン必須デコレーター
+from django.contrib.admin.views.decorators import staff_member_required  # スタッフ専用ページ用のデコレーター
 from django.contrib.auth.mixins import LoginRequiredMixin  # ログインしていないユーザーをログインページへ誘導
+from django.contrib.auth.models import AnonymousUser  # 共有ページの事前描画は特定のユーザーとして行わない
 from django.core.exceptions import PermissionDenied  # 権限のない操作を検出したときに 403 を返すための例外
-from django.core.paginator import Paginator  # 一覧データをページ分割するクラス
 from django.contrib import messages  # フラッシュメッセージ（画面上部に一時的に表示する通知）
-from django.http import Http404  # 対象データが見つからなかった場合に 404 を返すための例外
-from django.db.models import Avg, Q, Count  # 集計(Avg/Count)や柔軟な検索条件(Q)に使うヘルパー
+from django.http import Http404, HttpRequest, JsonResponse, FileResponse, QueryDict  # 404 用の例外と各種レスポンス
+from django.conf import settings  # sitemap の事前生成ファイルの置き場所やテンプレートエンジンの指定を参照する
+from django.template import engines  # 登録済みのテンプレートエンジン（DTL / Jinja2）
+
+from .models import Book, Review, RatingHistogram
+from .consts import AUTOCOMPLETE_RESULTS, AUTOCOMPLETE_MAX_RESULTS
+from .autocomplete import search_titles
+from . import admission, pagecache, queries, timeline
+from .streaming import streaming_response
+from .viewcounts import view_counter
+
+
+# Jinja2 版のテンプレートがあるビュー（描画の重いトップ・一覧・詳細だけ）。
+# 中身は book/templates と同じ出力になるよう保つ（book/tests.py の TemplateEngineParityTests）
+JINJA2_VIEWS = ('index', 'list-book', 'detail-book')
+
+
+def template_engine_for(url_name):
+    """settings.BOOK_TEMPLATE_ENGINES で指定されたエンジン名を返す。未指定・未登録なら None（既定の DTL）。
+
+    Jinja2 は JINJA2_VIEWS のビューにだけ使い、それ以外は指定されていても DTL で描画する。
+    """
+
+    name = settings.BOOK_TEMPLATE_ENGINES.get(url_name)
+    if name == 'jinja2' and url_name not in JINJA2_VIEWS:
+        return None
+    if name and name in engines.templates:
+        return name
+    return None
+
+
+class SelectableEngineMixin:
+    """テンプレートエンジンを URL 名ごとに切り替えられるようにする Mixin。"""
+
+    engine_key = None
+
+    @property
+    def template_engine(self):
+        return template_engine_for(self.engine_key)
+
+
+class SharedPageCacheMixin:
+    """GET の応答を全ユーザー共通でキャッシュする Mixin（book/pagecache.py）。
+
+    ユーザーごとに変わる部分は目印にして描画し、応答のたびにそのユーザー向けに埋める。
+    """
+
+    def get(self, request, *args, **kwargs):
+        if not pagecache.shared_page_enabled():
+            return super().get(request, *args, **kwargs)
+        return pagecache.shared_page_response(
+            request, lambda: super(SharedPageCacheMixin, self).get(request, *args, **kwargs).render()
+        )
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx['shared_page'] = pagecache.shared_page_enabled()
+        return ctx
+
+
+class LazyFormMixin:
+    """フォームクラスを最初に使うときに book.forms から読み込む Mixin。
+
+    フォームとウィジェットの定義を URLconf の読み込み時（ワーカー起動時）に import しないため。
+    """
 
-from .models import Book, Review
-from .forms import ReviewForm, BookForm
-from .consts import ITEM_PER_PAGE
+    form_class_name = None
 
+    def get_form_class(self):
+        from . import forms
+        return getattr(forms, self.form_class_name)
 
-class ListBookView(LoginRequiredMixin, ListView):
+
+class ListBookView(SharedPageCacheMixin, SelectableEngineMixin, LoginRequiredMixin, ListView):
     """書籍一覧ページ。検索キーワードやカテゴリで絞り込みできる。"""
 
     template_name = 'book/book_list.html'
     model = Book
+    engine_key = 'list-book'
     paginate_by = None  # ページングはテンプレート側で制御する
 
     def get_queryset(self):
         """クエリパラメーターを見て、検索条件を適用した本の一覧を返す。"""
 
-        # 最新の投稿が先に表示されるよう、新しいID順で取得
-        qs = super().get_queryset().order_by('-id')
-
-        # `q` パラメーターがあればタイトル／本文／カテゴリの部分一致で検索
+        # `q` パラメーターがあればタイトル／本文／カテゴリの部分一致で検索し、
+        # `cat` パラメーターがあればカテゴリで絞り込む。最新の投稿が先に表示されるよう新しいID順
         q = self.request.GET.get('q', '').strip()
-        if q:
-            qs = qs.filter(
-                Q(title__icontains=q) | Q(text__icontains=q) | Q(category__icontains=q)
-            )
-
-        # `cat` パラメーターがあればカテゴリで絞り込み
         cat = self.request.GET.get('cat', '').strip()
-        if cat:
-            qs = qs.filter(category=cat)
-
-        return qs
+        return queries.search_books(q, cat)
 
     def get_context_data(self, **kwargs):
         """テンプレートで必要となる補足情報を詰め込んで返す。"""
 
         ctx = super().get_context_data(**kwargs)
 
-        # DBに登録されているカテゴリを列挙し、テンプレートでタグ表示できるよう整形
-        raw_categories = (
-            Book.objects.exclude(category='')
-            .values_list('category', flat=True)
-            .distinct()[:20]
-        )
+        # DBに登録されているカテゴリを列挙し、テンプレートでタグ表示できるよう整形（キャッシュ済み）
+        ctx['categories'] = queries.category_list(limit=20)
         category_labels = dict(Book._meta.get_field('category').choices)
-        ctx['categories'] = [
-            {
-                'value': value,
-                'label': category_labels.get(value, value),
-            }
-            for value in raw_categories
-        ]
 
         # 検索フォームに入力した値をそのまま戻すため、現在の条件を渡す
         ctx['current_query'] = self.request.GET.get('q', '').strip()
@@ -68,16 +117,24 @@ class ListBookView(LoginRequiredMixin, ListView):
         ctx['category_labels'] = category_labels
         ctx['current_category_label'] = category_labels.get(ctx['current_category'], '')
 
-        # テンプレートで冊数を表示できるよう、件数も渡す
-        ctx['total_books'] = ctx['object_list'].count()
+        # テンプレートで冊数を表示できるよう、件数も渡す（キャッシュ済み）
+        ctx['total_books'] = queries.count_books(ctx['current_query'], ctx['current_category'])
         return ctx
 
 
-class DetailBookView(LoginRequiredMixin, DetailView):
+class DetailBookView(SharedPageCacheMixin, SelectableEngineMixin, LoginRequiredMixin, DetailView):
     """書籍の詳細ページ。レビュー一覧も同時に描画する。"""
 
     template_name = 'book/book_detail.html'
     model = Book
+    engine_key = 'detail-book'
+
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        # 閲覧数はメモリ上で数えておき、まとめて DB に書き出す
+        # 共有キャッシュから返した場合は self.object が無いので URL の pk で数える
+        view_counter.record(kwargs['pk'])
+        return response
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
@@ -85,23 +142,30 @@ class DetailBookView(LoginRequiredMixin, DetailView):
         ctx['reviews'] = (
             self.object.review_set.select_related('user').order_by('-id')
         )
-        # テンプレートで「編集／削除ボタンを表示して良いか」を判定するフラグ
-        ctx['is_owner'] = self.object.user == self.request.user
+        # 評価点の分布。レビューを集計せず、差分更新している RatingHistogram を読む
+        histogram = getattr(self.object, 'rating_histogram', None) or RatingHistogram(book=self.object)
+        ctx['rating_histogram'] = histogram
+        ctx['rating_distribution'] = histogram.distribution()
+        # 編集・削除ボタンは登録者本人にだけ表示する。共有キャッシュに載せないよう
+        # テンプレート側で `user_fragment` として描画する
         return ctx
 
 
-class CreateBookView(LoginRequiredMixin, CreateView):
+class CreateBookView(LazyFormMixin, LoginRequiredMixin, CreateView):
     """書籍の新規登録フォーム。"""
 
     template_name = 'book/book_create.html'
     model = Book
-    form_class = BookForm
+    form_class_name = 'BookForm'
     success_url = reverse_lazy('book:list-book')
 
     def form_valid(self, form):
         # 投稿者はフォームに表示していないので、ログインユーザーを自動でセット
         form.instance.user = self.request.user
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        # 新着アクティビティのタイムラインへ書き込み時に配っておく
+        timeline.push_book(self.object)
+        return response
 
 
 class DeleteBookView(LoginRequiredMixin, DeleteView):
@@ -127,11 +191,11 @@ class DeleteBookView(LoginRequiredMixin, DeleteView):
         return obj
 
 
-class UpdateBookView(LoginRequiredMixin, UpdateView):
+class UpdateBookView(LazyFormMixin, LoginRequiredMixin, UpdateView):
     """書籍編集フォーム。投稿者本人のみ編集可能。"""
 
     model = Book
-    form_class = BookForm
+    form_class_name = 'BookForm'
     template_name = 'book/book_update.html'
 
     def get_object(self, queryset=None):
@@ -141,6 +205,12 @@ class UpdateBookView(LoginRequiredMixin, UpdateView):
             raise PermissionDenied
         return obj
 
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        # タイムラインに複製している書籍タイトルも揃える
+        timeline.update_book(self.object)
+        return response
+
     def get_success_url(self):
         # 編集完了後は詳細ページに戻す
         return reverse('book:detail-book', kwargs={'pk': self.object.id})
@@ -149,48 +219,57 @@ class UpdateBookView(LoginRequiredMixin, UpdateView):
 def index_view(request):
     """トップページ。新着書籍とレビュー評価ランキングを表示する。"""
 
+    # ログインユーザーごとに変わる部分を除いた本文は全ユーザーで共有してキャッシュする
+    if pagecache.shared_page_enabled():
+        return pagecache.shared_page_response(request, lambda: _render_index(request, shared_page=True))
+    return _render_index(request)
+
+
+def prerender_shared_page(path):
+    """`path` のページ本文を描画して共有キャッシュに載せる（warm_caches 用）。
+
+    本文はユーザーによらないので匿名のリクエストで描画する。ログイン確認と閲覧数の記録は通さない。
+    """
+
+    url = urlsplit(path)
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = url.path
+    request.GET = QueryDict(url.query)
+    request.user = AnonymousUser()
+    request.resolver_match = match = resolve(url.path)
+    if match.func is index_view:
+        render_page = lambda: _render_index(request, shared_page=True)
+    else:
+        view = match.func.view_class(**match.func.view_initkwargs)
+        view.setup(request, *match.args, **match.kwargs)
+        # SharedPageCacheMixin.get と同じく、その先の get で描画する
+        render_page = lambda: super(SharedPageCacheMixin, view).get(request, *match.args, **match.kwargs).render()
+    return pagecache.shared_page_response(request, render_page)
+
+
+def _render_index(request, shared_page=False):
     q = request.GET.get('q', '').strip()
     selected_category = request.GET.get('cat', '').strip()
 
     # 新着一覧（検索条件を適用）
-    books = Book.objects.order_by('-id')
-    if q:
-        books = books.filter(
-            Q(title__icontains=q) | Q(text__icontains=q) | Q(category__icontains=q)
-        )
-    if selected_category:
-        books = books.filter(category=selected_category)
-
-    # ランキング用に平均点とレビュー数を計算。レビューが1件以上あるものだけ残す
-    ranking_books = (
-        books.annotate(
-            avg_rating=Avg('review__rate'),  # 平均評価を SQL の集計で計算
-            review_count=Count('review'),  # レビュー件数も同時に取得
-        )
-        .filter(review_count__gt=0)  # レビューが 0 件の書籍はランキングから除外
-        .order_by('-avg_rating')  # 平均評価の高い順に並べ替え
-    )
+    books = queries.search_books(q, selected_category)
 
-    # ランキングは ITEM_PER_PAGE 件ずつページングする
-    paginator = Paginator(ranking_books, ITEM_PER_PAGE)
+    # 評価順ランキングは ITEM_PER_PAGE 件ずつページングし、ページ単位でキャッシュする
     page_number = request.GET.get('page', 1)
-    page_obj = paginator.get_page(page_number)
+    page_obj = queries.ranking_page(q, selected_category, page_number)
 
-    # カテゴリ一覧を描画用に整形
-    categories = (
-        Book.objects.exclude(category='')
-        .values_list('category', flat=True)
-        .distinct()
-    )
+    # 閲覧数ベースの人気ランキング。refresh_trending で事前計算した表から読むだけ
+    trending_list = queries.trending_books(selected_category)
+
+    # 新着アクティビティ。書き込み時に作っておいたタイムラインを 1 ページ分読むだけ
+    # 自分の書籍へのレビューはユーザーごとの部品（my-activity）として描画する
+    recent_activity = timeline.read()
+
+    # カテゴリ一覧を描画用に整形（キャッシュ済み）
+    category_list = queries.category_list()
     category_labels = dict(Book._meta.get_field('category').choices)
     current_category_label = category_labels.get(selected_category, '')
-    category_list = [
-        {
-            'value': value,
-            'label': category_labels.get(value, value),
-        }
-        for value in categories
-    ]
 
     return render(
         request,
@@ -199,20 +278,41 @@ def index_view(request):
             'object_list': books,
             'ranking_list': page_obj.object_list,
             'page_obj': page_obj,
+            'trending_list': trending_list,
+            'recent_activity': recent_activity,
+            'shared_page': shared_page,
             'categories': category_list,
             'current_query': q,
             'current_category': selected_category,
             'category_labels': category_labels,
             'current_category_label': current_category_label,
         },
+        using=template_engine_for('index'),
     )
 
 
-class CreateReviewView(LoginRequiredMixin, CreateView):
+@login_required
+def autocomplete_view(request):
+    """検索ボックスの入力補完。メモリ上のタイトル索引からレビュー件数順に候補を返す。"""
+
+    q = request.GET.get('q', '').strip()
+    try:
+        limit = int(request.GET.get('limit', AUTOCOMPLETE_RESULTS))
+    except ValueError:
+        limit = AUTOCOMPLETE_RESULTS
+    limit = max(1, min(limit, AUTOCOMPLETE_MAX_RESULTS))
+
+    results = search_titles(q, limit) if q else []
+    for result in results:
+        result['url'] = reverse('book:detail-book', kwargs={'pk': result['id']})
+    return JsonResponse({'query': q, 'results': results})
+
+
+class CreateReviewView(LazyFormMixin, LoginRequiredMixin, CreateView):
     """レビュー新規作成フォーム。URL の book_id から紐付け先を決める。"""
 
     model = Review
-    form_class = ReviewForm
+    form_class_name = 'ReviewForm'
     template_name = 'book/review_form.html'
 
     def get_context_data(self, **kwargs):
@@ -227,18 +327,21 @@ class CreateReviewView(LoginRequiredMixin, CreateView):
         # 投稿者と対象書籍はフォームに表示していないのでビュー側でセットする
         form.instance.user = self.request.user
         form.instance.book = Book.objects.get(pk=self.kwargs['book_id'])
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        # 全体と書籍登録者のタイムラインへ書き込み時に配っておく
+        timeline.push_review(self.object)
+        return response
 
     def get_success_url(self):
         # 登録後は対象書籍の詳細ページへ戻る
         return reverse('book:detail-book', kwargs={'pk': self.object.book.id})
 
 
-class ReviewUpdateView(LoginRequiredMixin, UpdateView):
+class ReviewUpdateView(LazyFormMixin, LoginRequiredMixin, UpdateView):
     """レビュー編集フォーム。投稿者本人だけが利用できる。"""
 
     model = Review
-    form_class = ReviewForm
+    form_class_name = 'ReviewForm'
     template_name = 'book/review_form.html'
 
     def get_object(self, queryset=None):
@@ -253,6 +356,11 @@ class ReviewUpdateView(LoginRequiredMixin, UpdateView):
         ctx['mode'] = 'update'  # 同じテンプレートを新規／編集で使い回すフラグ
         return ctx
 
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        timeline.update_review(self.object)
+        return response
+
     def get_success_url(self):
         return reverse('book:detail-book', kwargs={'pk': self.object.book.id})
 
@@ -279,3 +387,74 @@ class ReviewDeleteView(LoginRequiredMixin, DeleteView):
     def get_success_url(self):
         # 削除後は対象書籍の詳細へ戻る
         return reverse('book:detail-book', kwargs={'pk': self.object.book.id})
+
+
+def _prerendered_response(name, content_type, last_modified):
+    """`render_feeds` コマンドで書き出したファイルがあり、`last_modified` より新しければそれを返す。
+
+    書き出した後に書籍・レビューが変わっていれば（削除を含む。feeds.latest_update）None を返し、
+    呼び出し側でその場で生成させる。
+    """
+
+    path = settings.SITEMAP_ROOT / name
+    try:
+        written_at = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    if last_modified is not None and last_modified.timestamp() > written_at:
+        return None
+    return FileResponse(path.open('rb'), content_type=content_type)
+
+
+def _base_url(request):
+    return f'{request.scheme}://{request.get_host()}'
+
+
+def sitemap_index_view(request):
+    """sitemap index。書籍ID の範囲ごとに分割した sitemap へのリンクを返す。"""
+
+    # 生成処理はクローラーからのアクセス時にだけ読み込む（起動時間のため）
+    from .feeds import buffered, iter_sitemap_index, latest_update
+
+    content_type = 'application/xml; charset=utf-8'
+    response = _prerendered_response('sitemap.xml', content_type, latest_update())
+    if response is None:
+        response = streaming_response(
+            request, buffered(iter_sitemap_index(_base_url(request))), content_type=content_type
+        )
+    return response
+
+
+def sitemap_books_view(request, chunk):
+    """分割された sitemap の 1 ファイル分。各書籍の詳細ページと lastmod を返す。"""
+
+    from .feeds import buffered, iter_sitemap_chunk, latest_update
+
+    content_type = 'application/xml; charset=utf-8'
+    response = _prerendered_response(f'sitemap-books-{chunk}.xml', content_type, latest_update())
+    if response is None:
+        response = streaming_response(
+            request, buffered(iter_sitemap_chunk(_base_url(request), chunk)), content_type=content_type
+        )
+    return response
+
+
+def feed_view(request):
+    """新着書籍・レビューの Atom フィード。"""
+
+    from .feeds import buffered, iter_atom_feed, latest_update
+
+    content_type = 'application/atom+xml; charset=utf-8'
+    response = _prerendered_response('feed.atom', content_type, latest_update(reviews=True))
+    if response is None:
+        response = streaming_response(
+            request, buffered(iter_atom_feed(_base_url(request))), content_type=content_type
+        )
+    return response
+
+
+@staff_member_required
+def admission_stats_view(request):
+    """流入制御の段階ごとの状況（このワーカープロセス分）を JSON で返す。監視用。"""
+
+    return JsonResponse({'pid': os.getpid(), 'tiers': admission.stats()})
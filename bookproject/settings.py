@@ -10,7 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
-import dj_database_url
+import os
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,19 +47,38 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'book.middleware.AdmissionControlMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'book.middleware.SlowQueryMiddleware',
 ]
 
+# ルートの重さの段階ごとの同時処理数（ワーカープロセスごと）と、待ち行列の長さ・待ち秒数。
+# 待っても空かなければ 503 を返し、Retry-After に retry_after 秒を入れる（book/admission.py）
+ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', '1') == '1'
+ADMISSION_TIERS = {
+    'expensive': {'concurrency': 2, 'queue': 4, 'timeout': 2.0, 'retry_after': 5},
+    'standard': {'concurrency': 8, 'queue': 16, 'timeout': 1.0, 'retry_after': 2},
+    'cheap': {'concurrency': 32, 'queue': 64, 'timeout': 0.5, 'retry_after': 1},
+}
+
+# この時間（ミリ秒）を超えたクエリを SlowQuery に記録する。既定では記録しない
+# （記録用のスレッドが DB に書き込むので、調査するときだけ SLOW_QUERY_THRESHOLD_MS=200 などを指定する）
+_slow_query_threshold = os.environ.get('SLOW_QUERY_THRESHOLD_MS', '')
+SLOW_QUERY_THRESHOLD_MS = float(_slow_query_threshold) if _slow_query_threshold else None
+# PostgreSQL では EXPLAIN (ANALYZE, BUFFERS) で実測の計画を取る（クエリをもう一度実行する）
+SLOW_QUERY_EXPLAIN_ANALYZE = os.environ.get('SLOW_QUERY_EXPLAIN_ANALYZE') == '1'
+
 ROOT_URLCONF = 'bookproject.urls'
 
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'NAME': 'django',
         #htmlファイルが入っている場所をDjangoに伝える
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
@@ -73,6 +93,49 @@ TEMPLATES = [
     },
 ]
 
+if not DEBUG:
+    # 本番では読み込んだテンプレートをコンパイル済みのまま使い回す（cached loader を明示）
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
+# Jinja2 は任意（pip install Jinja2）。テンプレートは jinja2/ と各アプリの jinja2/ に置く
+# Jinja2 自体は import しない（起動時間のため）
+JINJA2_ENGINE = None
+if find_spec('jinja2') is not None:
+    JINJA2_ENGINE = {
+        'BACKEND': 'django.template.backends.jinja2.Jinja2',
+        'NAME': 'jinja2',
+        'DIRS': [BASE_DIR / 'jinja2'],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'environment': 'book.jinja_env.environment',
+            'context_processors': [
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    }
+
+# トップ・書籍一覧・書籍詳細の本文を全ユーザー共通でキャッシュする（book/pagecache.py）。既定は無効。
+# SHARED_PAGE_CACHE=1 でも、ワーカー間で共有されるキャッシュ（SHARED_CACHE）が無ければ使わない
+SHARED_PAGE_CACHE = os.environ.get('SHARED_PAGE_CACHE') == '1'
+
+# ビューごとのテンプレートエンジン（URL 名 → エンジン名）。未指定や未登録のエンジンは DTL で描画する
+# Jinja2 版があるのは index / list-book / detail-book だけ（book.views.JINJA2_VIEWS）
+# 例: BOOK_TEMPLATE_ENGINES=index:jinja2,list-book:jinja2
+BOOK_TEMPLATE_ENGINES = dict(
+    item.split(':', 1) for item in os.environ.get('BOOK_TEMPLATE_ENGINES', '').split(',') if ':' in item
+)
+
+# Jinja2 エンジンは使うビューがあるときだけ登録する。登録されていると、エンジン未指定の
+# render() でも最初の描画時に全エンジンが初期化され、Jinja2 の import 分だけ起動が遅くなる
+if JINJA2_ENGINE and 'jinja2' in BOOK_TEMPLATE_ENGINES.values():
+    TEMPLATES.append(JINJA2_ENGINE)
+
 WSGI_APPLICATION = 'bookproject.wsgi.application'
 
 
@@ -87,6 +150,9 @@ DATABASES = {
 }
 
 if not DEBUG:
+    # 本番でしか使わないので、開発時の起動では import しない
+    import dj_database_url
+
     DATABASES = {
         'dafault' : dj_database_url.config(
             # Replace this value with your local database's connection string.
@@ -94,6 +160,35 @@ if not DEBUG:
         )
     }
 
+# 一覧・ランキング・共有ページのキャッシュ（book/caching.py）と認証の回数制限（accounts/throttling.py）。
+# ワーカー間で共有するキャッシュを CACHE_BACKEND で選ぶ。
+#   redis: REDIS_URL の Redis（pip install redis）
+#   db:    DB のテーブル django_cache（python manage.py createcachetable で作る）
+# 未指定ならワーカーごとのメモリキャッシュになる。書き込みによる無効化が他のワーカーに
+# 伝わらないので、その場合は読み取り結果をキャッシュしない（SHARED_CACHE = False）
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', '')
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+        }
+    }
+elif CACHE_BACKEND == 'db':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+SHARED_CACHE = CACHE_BACKEND in ('redis', 'db')
+
 ALLOWED_HOSTS = ['*']
 
 # Password validation
@@ -115,6 +210,36 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# パスワードハッシュ。PBKDF2 の同時計算数は accounts.hashers で PASSWORD_HASHING_WORKERS 本に抑える
+# 反復回数は Django の既定値（5.1 では 87 万回）で、PASSWORD_HASH_ITERATIONS を指定すると
+# それより多くできる（少なくはできない）。`benchmark_login` コマンドの計測結果を目安にする。
+# 保存済みハッシュの回数が少ない場合は、ログイン成功時に自動で再ハッシュされる
+PASSWORD_HASHERS = [
+    'accounts.hashers.PooledPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_HASH_ITERATIONS = int(os.environ['PASSWORD_HASH_ITERATIONS']) if os.environ.get('PASSWORD_HASH_ITERATIONS') else None
+# ハッシュ計算に使うスレッド数（ワーカープロセスあたり）。マシン全体で CPU の半分までに抑え、
+# 残りを書籍ページの描画に回す。上限はプロセスごとなので、ワーカー数（WEB_CONCURRENCY）で割る
+PASSWORD_HASHING_WORKERS = max(1, (os.cpu_count() or 2) // 2 // max(1, int(os.environ.get('WEB_CONCURRENCY') or 1)))
+
+# ログイン・会員登録・会員情報変更・データのダウンロードの回数制限（回数, 秒）
+# 回数は既定のキャッシュ（CACHES）で数える。CACHE_BACKEND が未指定でワーカーごとのメモリキャッシュの
+# 場合はワーカーごとに数えるので、実際の上限はここの回数 × ワーカー数（WEB_CONCURRENCY）になる
+AUTH_THROTTLE_RATES = {
+    'login-ip': (20, 60),
+    'login-user': (5, 60),
+    'signup-ip': (5, 300),
+    'profile-user': (5, 60),
+    'export-user': (3, 300),
+}
+# Render などのプロキシ配下では True にして X-Forwarded-For から IP を取る
+THROTTLE_TRUST_X_FORWARDED_FOR = os.environ.get('THROTTLE_TRUST_X_FORWARDED_FOR') == '1'
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -135,6 +260,9 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# `render_feeds` コマンドで事前生成した sitemap / Atom フィードの置き場所
+SITEMAP_ROOT = BASE_DIR / 'sitemaps'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -8,9 +8,18 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
 """
 
 import os
+import threading
 
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bookproject.settings')
 
 application = get_wsgi_application()
+
+# WARM_CACHES_ON_BOOT=1 のときはワーカー起動時にバックグラウンドでキャッシュと入力補完のインデックスを用意する
+if os.environ.get('WARM_CACHES_ON_BOOT') == '1':
+    from django.core.management import call_command
+
+    threading.Thread(
+        target=call_command, args=('warm_caches',), kwargs={'title_index': True}, daemon=True
+    ).start()
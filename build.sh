@@ -3,3 +3,5 @@ pip install -r requirements.txt
 python3 manage.py collectstatic --no-input
 python3 manage.py migrate
 python3 manage.py superuser
+python3 manage.py createcachetable
+python3 manage.py warm_caches